@@ -0,0 +1,104 @@
+"""Micro-benchmark of the JSON codecs on tmpllist responses and wtag messages
+
+    python benchmarks/json_codec.py [--repeat N]
+
+Compares the old pretty-printed json.dumps(indent=2) with the compact wire
+encoding of each available codec (json, ujson, orjson): encode and decode
+time per message and payload size.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+def tmpllist_response(templates=20):
+    """tmpllist answer as published by handle_template_request"""
+    return {
+        'shop': 'BY001',
+        'data': {
+            'tmpls': [{
+                'name': f"AES模板2.13T_{i:02d}",
+                'id': str(1961431624180719617 + i),
+                'md5': uuid.uuid4().hex,
+                'status': 'available',
+            } for i in range(templates)],
+            'url': 'http://10.3.36.36:8080/api/res/templ/loadtemple',
+            'tid': str(uuid.uuid4()),
+        },
+        'id': str(uuid.uuid4()),
+        'command': 'tmpllist_response',
+        'timestamp': time.time(),
+    }
+
+def wtag_message(tags=100):
+    """wtag message with tags shaped like the README example"""
+    value = {'GOODS_CODE': '00101', 'GOODS_NAME': '2.13T', 'F_01': '-1.00', 'F_02': 'PRODUCT_FRUIT',
+             'F_10': 'http://10.3.36.25:82/dev/file/download?id=1961436967577214978&Domain=http://localhost:81',
+             'F_12': '<p>98</p>', 'F_13': 'kg'}
+    value.update({f"F_{i:02d}": '98.00' for i in (3, 4, 5, 6, 7, 8, 9, 11, 14, 15, 16, 17, 18)})
+    return {
+        'command': 'wtag',
+        'data': [{
+            'tag': 6597069775359 + i,
+            'tmpl': 'AES模板2.13T',
+            'model': '06',
+            'checksum': 'FCC5FDFD83486FF8E66F41D5691E0C1E',
+            'forcefrash': 1,
+            'value': dict(value, GOODS_CODE=f"{i:05d}"),
+            'taskid': 74952 + i,
+            'token': 974731,
+        } for i in range(tags)],
+        'id': str(uuid.uuid4()),
+        'timestamp': time.time(),
+        'shop': 'BY001',
+    }
+
+def codecs():
+    """(name, encode, decode) of every codec to compare"""
+    yield ('json indent=2 (old)', lambda obj: json.dumps(obj, indent=2).encode('utf-8'), json.loads)
+    yield ('json compact', lambda obj: json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8'),
+           json.loads)
+    if ujson:
+        yield ('ujson', lambda obj: ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False).encode('utf-8'),
+               ujson.loads)
+    if orjson:
+        yield ('orjson', orjson.dumps, orjson.loads)
+
+def timed(func, arg, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(arg)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+    
+    from esl_core import JSON_CODEC
+    print(f"esl_core codec: {JSON_CODEC}")
+    for title, payload in (('tmpllist response, 20 templates', tmpllist_response()),
+                           ('wtag message, 100 tags', wtag_message())):
+        print(f"\n{title}")
+        print(f"{'codec':<22}{'bytes':>9}{'encode us':>12}{'decode us':>12}")
+        for name, encode, decode in codecs():
+            data = encode(payload)
+            assert decode(data) == json.loads(data)
+            print(f"{name:<22}{len(data):>9}{timed(encode, payload, args.repeat):>12.1f}"
+                  f"{timed(decode, data, args.repeat):>12.1f}")
+
+if __name__ == '__main__':
+    main()
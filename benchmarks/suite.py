@@ -0,0 +1,312 @@
+"""Benchmark suite for the template server hot paths
+
+    python benchmarks/suite.py [--scales 10,1000,10000] [--duration 3] [--clients 8]
+                               [--output results.json] [--compare baseline.json]
+
+Everything runs in this process against a synthetic resource directory of
+generated templates modelled on resource/AES模板2.13T_06.json; no broker or
+other outside service is needed (MQTT traffic goes through an in-process
+stand-in broker). For every scale it measures:
+
+- TemplateManager: initial scan, no-op rescan, find_template by name, ID
+  and substring
+- HTTP: concurrent keep-alive clients on loadtemple and list
+- MQTT: tmpllist requests through on_message and the worker pool, and
+  handle_template_request called directly
+
+Results are written as JSON; --compare prints the change against an
+earlier result file (rates: higher is better, *_ms/*_us: lower is better)
+and flags changes beyond --noise percent.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from paho.mqtt import client as mqtt
+
+import esl_core
+from esl_core import TemplateManager, TemplateServer, create_http_server, TemplateHTTPHandler
+
+SAMPLE_TEMPLATE = os.path.join(ROOT, 'resource', 'AES模板2.13T_06.json')
+
+def quiet(*args):
+    pass
+
+def percentiles(samples):
+    """p50/p95/p99 of latency samples (seconds) in milliseconds"""
+    if not samples:
+        return {}
+    samples = sorted(samples)
+    return {f'p{p}_ms': round(samples[min(len(samples) - 1, len(samples) * p // 100)] * 1000, 3)
+            for p in (50, 95, 99)}
+
+def timed(func, repeat):
+    """Seconds per call of func"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+def make_resource(directory, count):
+    """Write count templates derived from the sample template, returns their names"""
+    with open(SAMPLE_TEMPLATE, 'r', encoding='utf-8') as f:
+        sample = json.load(f)
+    names = []
+    for i in range(count):
+        name = f"AES模板2.13T_{i:05d}"
+        sample['Name'] = name
+        with open(os.path.join(directory, name + '.json'), 'w', encoding='utf-8') as f:
+            json.dump(sample, f, ensure_ascii=False)
+        names.append(name)
+    return names
+
+def bench_manager(directory, names, lookups=20000):
+    start = time.perf_counter()
+    manager = TemplateManager(directory, logger=quiet)
+    initial_scan = time.perf_counter() - start
+    rescan = timed(manager.scan_templates, 5)
+    
+    rng = random.Random(1)
+    picks = [rng.choice(names) for _ in range(lookups)]
+    ids = [manager.index.by_name[name]['id'] for name in picks]
+    # Substring lookups hit the fuzzy (trigram) index
+    fragments = [name[-7:] for name in picks[:lookups // 10]]
+    
+    results = {
+        'scan_initial_ms': round(initial_scan * 1000, 3),
+        'scan_noop_ms': round(rescan * 1000, 3),
+    }
+    for label, func, args in (('find_name', lambda name: manager.find_template(name=name), picks),
+                              ('find_id', lambda tid: manager.find_template(template_id=tid), ids),
+                              ('find_substring', lambda name: manager.find_template(name=name), fragments)):
+        start = time.perf_counter()
+        for arg in args:
+            func(arg)
+        results[f'{label}_per_s'] = round(len(args) / (time.perf_counter() - start), 1)
+    return manager, results
+
+def http_clients(port, clients, duration, request):
+    """Run clients keep-alive connections calling request(conn, rng) for duration seconds"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    
+    def client(seed):
+        rng = random.Random(seed)
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        local = []
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                status = request(conn, rng)
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                status = None
+            if status != 200:
+                with lock:
+                    errors[0] += 1
+                continue
+            local.append(time.perf_counter() - start)
+        conn.close()
+        with lock:
+            latencies.extend(local)
+    
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return dict(requests=len(latencies), errors=errors[0],
+                requests_per_s=round(len(latencies) / elapsed, 1), **percentiles(latencies))
+
+def bench_http(manager, names, clients, duration):
+    def handler(*args, **kwargs):
+        return TemplateHTTPHandler(*args, template_manager=manager, **kwargs)
+    server = create_http_server(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    
+    def loadtemple(conn, rng):
+        body = json.dumps({'name': rng.choice(names)}).encode('utf-8')
+        conn.request('POST', '/api/res/templ/loadtemple', body, {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    
+    def template_list(conn, rng):
+        conn.request('GET', '/api/res/templ/list', headers={'Accept-Encoding': 'gzip'})
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    
+    try:
+        return {
+            'loadtemple': http_clients(port, clients, duration, loadtemple),
+            'list': http_clients(port, clients, duration, template_list),
+        }
+    finally:
+        server.shutdown()
+        server.server_close()
+
+class FakeBroker:
+    """Stand-in for a connected paho client: publishes are recorded and acknowledged at once"""
+    
+    def __init__(self):
+        self.published = 0
+        self.bytes = 0
+        self.mid = 0
+        self.lock = threading.Lock()
+    
+    def publish(self, topic, payload, qos=0, retain=False):
+        with self.lock:
+            self.mid += 1
+            self.published += 1
+            self.bytes += len(payload)
+            info = mqtt.MQTTMessageInfo(self.mid)
+        info.rc = mqtt.MQTT_ERR_SUCCESS
+        info._set_as_published()
+        return info
+    
+    def subscribe(self, topic, qos=0):
+        return mqtt.MQTT_ERR_SUCCESS, 0
+    
+    def loop_stop(self):
+        pass
+    
+    def disconnect(self):
+        pass
+
+class FakeMessage:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+def bench_mqtt(directory, names, messages, shops=50, per_request=5):
+    server = TemplateServer({'resource_dir': directory, 'template_watch': False}, logger=quiet)
+    broker = FakeBroker()
+    server.client = broker
+    server.is_connected = True
+    
+    rng = random.Random(2)
+    requests = []
+    for i in range(messages):
+        shop = f"BY{i % shops:03d}"
+        # Tags of one shop ask for the same templates, as in a store roll-out
+        shop_rng = random.Random(shop)
+        tmpls = [{'name': shop_rng.choice(names), 'id': ''} for _ in range(per_request)]
+        payload = json.dumps({'shop': shop, 'command': 'tmpllist', 'id': str(i),
+                              'data': {'tmpls': tmpls, 'tid': str(rng.random())}}).encode('utf-8')
+        requests.append(FakeMessage('esl/server/request', payload))
+    
+    try:
+        start = time.perf_counter()
+        for message in requests:
+            server.on_message(broker, None, message)
+        enqueued = time.perf_counter() - start
+        while broker.published < messages and time.perf_counter() - start < 120:
+            time.sleep(0.001)
+        elapsed = time.perf_counter() - start
+        
+        direct = [json.loads(message.payload) for message in requests[:min(messages, 2000)]]
+        latencies = []
+        for request in direct:
+            begin = time.perf_counter()
+            server.handle_template_request(request)
+            latencies.append(time.perf_counter() - begin)
+        
+        return dict({
+            'messages': messages,
+            'answered': min(broker.published, messages),
+            'on_message_us': round(enqueued / messages * 1e6, 3),
+            'messages_per_s': round(min(broker.published, messages) / elapsed, 1),
+            'response_bytes_avg': round(broker.bytes / max(broker.published, 1), 1),
+            'tmpllist_cache_hit_rate': server.response_cache.stats()['hit_rate'],
+        }, **{f'handle_{key}': value for key, value in percentiles(latencies).items()})
+    finally:
+        server.dispatcher.stop()
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ''
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'json_codec': esl_core.JSON_CODEC,
+        'http_mode': esl_core.HTTP_CONCURRENCY_MODE,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+def compare(baseline, results, noise, path=''):
+    """Print the relative change of every rate and latency figure"""
+    for key, value in results.items():
+        old = baseline.get(key) if isinstance(baseline, dict) else None
+        name = f"{path}.{key}" if path else key
+        if isinstance(value, dict):
+            compare(old or {}, value, noise, name)
+        elif isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+            if key.endswith('_per_s'):
+                better = value >= old
+            elif key.endswith('_ms') or key.endswith('_us'):
+                better = value <= old
+            else:
+                continue
+            change = (value - old) / old * 100
+            verdict = '' if abs(change) < noise else 'better' if better else 'WORSE'
+            print(f"{name:<55}{old:>14}{value:>14}{change:>+9.1f}%  {verdict}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', default='10,1000,10000', help="comma separated template counts")
+    parser.add_argument('--duration', type=float, default=3.0, help="seconds per HTTP run")
+    parser.add_argument('--clients', type=int, default=8, help="concurrent HTTP clients")
+    parser.add_argument('--messages', type=int, default=5000, help="tmpllist requests per MQTT run")
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--compare', metavar='BASELINE', help="earlier result file to compare with")
+    parser.add_argument('--noise', type=float, default=10.0, help="changes below this percentage are not flagged")
+    args = parser.parse_args()
+    
+    report = {'environment': environment(), 'results': {}}
+    for scale in [int(value) for value in args.scales.split(',')]:
+        print(f"== {scale} templates", file=sys.stderr)
+        with tempfile.TemporaryDirectory(prefix='eslbench-') as directory:
+            names = make_resource(directory, scale)
+            manager, manager_results = bench_manager(directory, names)
+            print(f"   manager {manager_results}", file=sys.stderr)
+            http_results = bench_http(manager, names, args.clients, args.duration)
+            print(f"   http {http_results}", file=sys.stderr)
+            mqtt_results = bench_mqtt(directory, names, args.messages)
+            print(f"   mqtt {mqtt_results}", file=sys.stderr)
+        report['results'][str(scale)] = {'manager': manager_results, 'http': http_results, 'mqtt': mqtt_results}
+    
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+    
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"{'':<55}{'baseline':>14}{'now':>14}")
+        compare(baseline.get('results', {}), report['results'], args.noise)
+
+if __name__ == '__main__':
+    main()
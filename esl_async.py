@@ -0,0 +1,309 @@
+import asyncio
+import concurrent.futures
+import io
+import re
+import signal
+import threading
+
+from paho.mqtt import client as mqtt
+
+from esl_core import (
+    HTTP_KEEPALIVE_TIMEOUT, HTTP_MAX_BODY_SIZE, TemplateHTTPHandler, TemplateServer,
+)
+
+# Seconds a client may take to send the rest of a request once it started
+ASYNC_REQUEST_TIMEOUT = 30
+# Largest request head (request line and headers) accepted
+ASYNC_MAX_HEADER_SIZE = 64 * 1024
+
+_CONTENT_LENGTH = re.compile(rb'\r\ncontent-length[ \t]*:[ \t]*(\d+)', re.IGNORECASE)
+
+class LoopWriter(io.RawIOBase):
+    """File-like object that writes to an asyncio StreamWriter from another thread
+    
+    Each write waits until the data is handed to the transport and drained
+    below its high-water mark, so a slow client throttles the handler thread
+    instead of buffering the whole response.
+    """
+    
+    def __init__(self, writer, loop):
+        self.writer = writer
+        self.loop = loop
+    
+    def writable(self):
+        return True
+    
+    async def _write(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+    
+    def write(self, data):
+        data = bytes(data)
+        asyncio.run_coroutine_threadsafe(self._write(data), self.loop).result()
+        return len(data)
+
+class BufferedRequestHandler(TemplateHTTPHandler):
+    """TemplateHTTPHandler run on a request already read by the event loop
+    
+    The request is parsed from memory and the response goes to a LoopWriter,
+    so the handler code is shared with the threaded servers.
+    """
+    
+    def __init__(self, request_bytes, client_address, server, wfile, requests_handled, template_manager):
+        self.template_manager = template_manager
+        self.requests_handled = requests_handled
+        self._sending_error = False
+        self._status = None
+        self._started = 0.0
+        self._body_bytes = 0
+        self.client_address = client_address
+        self.server = server
+        self.rfile = io.BytesIO(request_bytes)
+        self.wfile = wfile
+        # Large templates are 'sent' through self.connection.sendfile
+        self.connection = self.request = self
+        self.close_connection = True
+    
+    def sendfile(self, file, offset=0, count=None):
+        """Copy a file range to the client in chunks (socket.sendfile stand-in)"""
+        file.seek(offset)
+        remaining = count
+        while remaining is None or remaining > 0:
+            chunk = file.read(65536 if remaining is None else min(65536, remaining))
+            if not chunk:
+                break
+            self.wfile.write(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    
+    def run(self):
+        """Handle the request, returns True if the connection must be closed"""
+        self.handle_one_request()
+        return self.close_connection
+
+class AsyncHTTPServer:
+    """Template HTTP server on an asyncio event loop
+    
+    Connections (including idle keep-alive ones) only cost a coroutine each.
+    Complete requests are handled by TemplateHTTPHandler on a bounded thread
+    pool, which also keeps file reads and hashing off the event loop.
+    """
+    
+    def __init__(self, template_manager, max_workers):
+        self.template_manager = template_manager
+        self.max_workers = max_workers
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                              thread_name_prefix='http-worker')
+        self.open_connections = 0
+        self.pending_requests = 0
+        self.rejected_connections = 0
+        self.health_providers = {}
+        self.loop = None
+        self._server = None
+    
+    async def start(self, host, port, backlog):
+        self.loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._serve_connection, host, port, backlog=backlog,
+                                                  limit=ASYNC_MAX_HEADER_SIZE, reuse_address=True)
+        self.server_address = self._server.sockets[0].getsockname()
+    
+    def describe(self):
+        return f"asyncio ({self.max_workers} request workers, {self.open_connections} open connections)"
+    
+    async def _serve_connection(self, reader, writer):
+        self.open_connections += 1
+        peer = writer.get_extra_info('peername') or ('', 0)
+        wfile = LoopWriter(writer, self.loop)
+        handled = 0
+        try:
+            while True:
+                try:
+                    # Idle keep-alive connections wait here without a thread
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), HTTP_KEEPALIVE_TIMEOUT)
+                    match = _CONTENT_LENGTH.search(head)
+                    length = int(match.group(1)) if match else 0
+                    body = b''
+                    if 0 < length <= HTTP_MAX_BODY_SIZE:
+                        body = await asyncio.wait_for(reader.readexactly(length), ASYNC_REQUEST_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                        ConnectionError):
+                    break
+                
+                handler = BufferedRequestHandler(head + body, peer, self, wfile, handled, self.template_manager)
+                self.pending_requests += 1
+                try:
+                    close = await self.loop.run_in_executor(self.executor, handler.run)
+                finally:
+                    self.pending_requests -= 1
+                handled += 1
+                # An oversized body was not read, so the connection cannot be reused
+                if close or length > HTTP_MAX_BODY_SIZE:
+                    break
+        except asyncio.CancelledError:
+            # Event loop shutting down with the connection still open
+            pass
+        except Exception as e:
+            self.template_manager.log_request(f"Connection error from {peer[0]}: {str(e)}")
+        finally:
+            self.open_connections -= 1
+            writer.close()
+    
+    def shutdown(self):
+        """Stop accepting connections (callable from any thread)"""
+        if self._server is not None and self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._server.close)
+    
+    def server_close(self):
+        self.executor.shutdown(wait=False)
+
+class AsyncioMQTT:
+    """Drive a paho client from an asyncio event loop instead of loop_start's thread
+    
+    The client socket is watched with add_reader/add_writer and loop_misc
+    (keepalive pings, retries) runs once a second. paho may request writes
+    from other threads (publishes from the MQTT workers); those socket
+    callbacks are passed to the loop with call_soon_threadsafe.
+    """
+    
+    def __init__(self, loop):
+        self.loop = loop
+        self._loop_thread = threading.get_ident()
+        self._fd = None
+        self._misc = None
+    
+    def _call(self, func, *args):
+        if threading.get_ident() == self._loop_thread:
+            func(*args)
+        else:
+            self.loop.call_soon_threadsafe(func, *args)
+    
+    def attach(self, client):
+        """Start watching the socket of a client that just connected (loop thread)"""
+        self._detach()
+        sock = client.socket()
+        if sock is None:
+            return
+        # Keep the descriptor: the socket may already be closed when the
+        # close callback reaches the loop
+        self._fd = sock.fileno()
+        client.on_socket_close = lambda c, userdata, sock: self._call(self._detach)
+        client.on_socket_register_write = lambda c, userdata, sock: self._call(self._watch_write, c)
+        client.on_socket_unregister_write = lambda c, userdata, sock: self._call(self._unwatch_write)
+        self.loop.add_reader(self._fd, client.loop_read)
+        if client.want_write():
+            self._watch_write(client)
+        self._misc = self.loop.create_task(self._misc_loop(client))
+    
+    def _watch_write(self, client):
+        sock = client.socket()
+        if self._fd is not None and sock is not None and sock.fileno() == self._fd:
+            self.loop.add_writer(self._fd, client.loop_write)
+    
+    def _unwatch_write(self):
+        if self._fd is not None:
+            self.loop.remove_writer(self._fd)
+    
+    def _detach(self):
+        if self._fd is not None:
+            self.loop.remove_reader(self._fd)
+            self.loop.remove_writer(self._fd)
+            self._fd = None
+        if self._misc:
+            self._misc.cancel()
+            self._misc = None
+    
+    async def _misc_loop(self, client):
+        while client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+class AsyncTemplateServer(TemplateServer):
+    """TemplateServer with HTTP and the MQTT connection on one asyncio event loop
+    
+    Template requests are still handled by the MQTT workers (per-shop order,
+    file and hash work off the loop); since on_message runs on the event loop,
+    a full worker queue drops the message at once instead of blocking.
+    """
+    
+    def __init__(self, config=None, logger=None):
+        super().__init__(config, logger)
+        self.dispatcher.enqueue_timeout = 0
+        self.loop = None
+        self.mqtt_loop = None
+    
+    def start_network_loop(self):
+        # connect() runs in an executor thread; the socket is watched by the loop
+        self.loop.call_soon_threadsafe(self.mqtt_loop.attach, self.client)
+    
+    async def serve_http(self):
+        """Start the asyncio HTTP server, returns False if it could not start"""
+        http_server = AsyncHTTPServer(self.template_manager, self.config['http_max_connections'])
+        try:
+            await http_server.start(self.config['http_host'], self.config['http_port'],
+                                    self.config['http_queue_depth'])
+        except OSError as e:
+            self.log(f"Failed to start HTTP server: {str(e)}", "ERROR")
+            http_server.server_close()
+            return False
+        self.attach_http_server(http_server)
+        self.log(f"HTTP Server started on port {http_server.server_address[1]} ({http_server.describe()})",
+                 "SUCCESS")
+        return True
+    
+    async def run(self, stop):
+        """Serve until stop is set, returns an exit code"""
+        self.loop = asyncio.get_running_loop()
+        self.mqtt_loop = AsyncioMQTT(self.loop)
+        if not await self.serve_http():
+            return 1
+        if self.config['template_watch']:
+            self.start_watcher()
+        
+        # Connect, and reconnect after losing the broker, with exponential backoff
+        delay = 1
+        while not stop.is_set():
+            if not self.is_connected:
+                try:
+                    await self.loop.run_in_executor(None, self.connect)
+                except Exception as e:
+                    self.log(f"Connection failed: {str(e)}, retrying in {delay}s", "ERROR")
+                    await self._wait(stop, delay)
+                    delay = min(delay * 2, 60)
+                    continue
+                # Give the broker time to answer before trying again
+                await self._wait(stop, self.config['mqtt_keepalive'], lambda: self.is_connected)
+            if self.is_connected:
+                delay = 1
+            await self._wait(stop, 1)
+        
+        self.log("Shutting down", "INFO")
+        self.shutdown()
+        return 0
+    
+    @staticmethod
+    async def _wait(stop, timeout, done=None):
+        """Wait up to timeout seconds for stop (or done() becoming true)"""
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not stop.is_set() and not (done and done()):
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(stop.wait(), min(remaining, 0.5 if done else remaining))
+            except asyncio.TimeoutError:
+                pass
+
+def run_async(config):
+    """Run the headless server on an asyncio event loop until SIGINT/SIGTERM"""
+    server = AsyncTemplateServer(config)
+    
+    async def main():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                signal.signal(sig, lambda signum, frame: loop.call_soon_threadsafe(stop.set))
+        return await server.run(stop)
+    
+    return asyncio.run(main())
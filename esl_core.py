@@ -0,0 +1,2612 @@
+import threading
+import json
+import os
+import hashlib
+import uuid
+from datetime import datetime
+from paho.mqtt import client as mqtt
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import socketserver
+import socket
+import queue
+import zlib
+import stat
+import functools
+import sys
+import select
+import selectors
+import struct
+import ctypes
+import ctypes.util
+import gzip
+import re
+import signal
+import bisect
+
+# Optional compressors for template downloads
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+# Optional fast JSON libraries; the standard json module is the fallback
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+from collections import OrderedDict, deque
+
+# HTTP template server settings
+HTTP_HOST = '0.0.0.0'
+HTTP_PORT = 8080
+# Concurrency mode: 'pool' (bounded worker pool), 'thread' (one thread per
+# connection), 'single' (serve one request at a time) or 'asyncio' (headless
+# only: HTTP connections and MQTT on one event loop, see esl_async)
+HTTP_CONCURRENCY_MODE = 'pool'
+# Number of connections served at the same time in 'pool' mode (requests
+# handled at the same time in 'asyncio' mode)
+HTTP_MAX_CONNECTIONS = 32
+# Accepted connections allowed to wait for a free worker before new ones
+# are answered with 503
+HTTP_QUEUE_DEPTH = 128
+# Headless only: number of HTTP server processes. With more than one, a
+# supervisor process keeps the template table and the MQTT connection and
+# starts this many workers sharing the port with SO_REUSEPORT (see esl_prefork)
+HTTP_PROCESSES = 1
+# Persistent HTTP/1.1 connections: idle timeout in seconds and the number of
+# requests served on one connection before it is closed (0 = unlimited)
+HTTP_KEEPALIVE = True
+HTTP_KEEPALIVE_TIMEOUT = 15
+HTTP_KEEPALIVE_MAX_REQUESTS = 100
+# In 'pool' mode a persistent connection with no next request after this
+# many seconds is handed back from its worker to a selector, and queued
+# again once the client sends something (idle clients do not hold workers)
+HTTP_POOL_PARK_DELAY = 0.005
+# Largest accepted POST body in bytes (larger requests get 413)
+HTTP_MAX_BODY_SIZE = 64 * 1024
+# Try to repair malformed JSON bodies (unquoted keys/values, outer single
+# quotes, as sent by hand-written curl commands) when strict parsing fails
+HTTP_JSON_REPAIR = True
+# 0: one line per request, 1: also request headers, 2: also raw body dumps
+HTTP_DEBUG_LEVEL = 0
+
+# Memory budget for cached template file contents (0 disables the cache)
+TEMPLATE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Templates larger than this (or all templates when the cache is disabled)
+# are streamed from disk with sendfile instead of being held in memory
+TEMPLATE_STREAM_THRESHOLD = 1024 * 1024
+# Content encodings offered for template downloads (only those whose module
+# is installed are used); variants are built once per template version
+TEMPLATE_COMPRESSION = ('zstd', 'br', 'gzip')
+TEMPLATE_GZIP_LEVEL = 9
+TEMPLATE_ZSTD_LEVEL = 19
+TEMPLATE_BROTLI_QUALITY = 11
+# Suffix appended to the entity tag of each compressed variant ("<md5>-gz"),
+# so a compressed body and the identity body never share a strong ETag
+ETAG_ENCODING_SUFFIXES = {'gzip': 'gz', 'br': 'br', 'zstd': 'zst'}
+# Compute a CRC32 next to the MD5 of every template for cheap internal
+# change detection
+TEMPLATE_FAST_DIGEST = True
+# Build a trigram index for substring ("fuzzy") template lookups; when
+# disabled the fuzzy fallback scans all templates
+TEMPLATE_FUZZY_INDEX = True
+
+# Template IDs are kept in this manifest inside the resource directory.
+# Files without an entry get an ID derived from their filename, so IDs stay
+# the same across rescans and restarts; edit the manifest to pin an ID.
+TEMPLATE_MANIFEST_NAME = '.template_ids'
+TEMPLATE_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, 'eslmqtt:template')
+
+# /api/res/templ/list?since=<version> reports removed templates from this many
+# removals back; older versions get the full list
+TEMPLATE_LIST_MAX_REMOVED = 10000
+
+# Watch the resource directory and reload changed templates automatically
+# (inotify on Linux, polling elsewhere)
+TEMPLATE_WATCH = True
+TEMPLATE_WATCH_POLL_INTERVAL = 2.0
+# Wait for this long without new file events before reloading, but never
+# longer than the max delay while events keep coming in
+TEMPLATE_WATCH_DEBOUNCE = 0.5
+TEMPLATE_WATCH_MAX_DELAY = 5.0
+
+# MQTT messages are handled by a pool of worker threads instead of paho's
+# network thread. Messages of one shop always go to the same worker, so they
+# are handled in order. When a worker queue is full the network thread waits
+# up to MQTT_ENQUEUE_TIMEOUT seconds (backpressure) before dropping the message.
+MQTT_WORKERS = 4
+MQTT_QUEUE_SIZE = 1000
+MQTT_ENQUEUE_TIMEOUT = 2.0
+# Seconds stop() waits for room in a full worker queue before dropping the
+# messages still waiting in it
+MQTT_STOP_TIMEOUT = 2.0
+
+# Tags of one shop send near-identical tmpllist requests within seconds. The
+# answer for a shop and template set is reused for this many seconds (0
+# disables it) as long as the template table is unchanged; only tid, id and
+# timestamp are filled in per response.
+TMPLLIST_CACHE_TTL = 5.0
+TMPLLIST_CACHE_MAX_ENTRIES = 1024
+
+# A shop counts as handled by this instance if it sent a request within this
+# many seconds (reported in /api/health)
+SHOP_ACTIVE_WINDOW = 600
+
+# Server settings. Every key can be overridden by a JSON config file and then
+# by an ESL_<KEY> environment variable (e.g. ESL_MQTT_HOST, ESL_HTTP_PORT);
+# list values are comma separated in the environment.
+DEFAULT_CONFIG = {
+    'mqtt_host': '127.0.0.1',
+    'mqtt_port': 1883,
+    'mqtt_username': '',
+    'mqtt_password': '',
+    'mqtt_keepalive': 60,
+    'subscribe_topics': ['template/request'],
+    # {shop} is replaced by the shop ID of the request
+    'response_topic': 'esl/server/data/{shop}',
+    # Used instead when the shop ID of a request cannot be put in a topic
+    'response_topic_default': 'template/response',
+    'template_url': 'http://10.3.36.36:8080/api/res/templ/loadtemple',
+    'resource_dir': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resource'),
+    'http_host': HTTP_HOST,
+    'http_port': HTTP_PORT,
+    'http_mode': HTTP_CONCURRENCY_MODE,
+    'http_max_connections': HTTP_MAX_CONNECTIONS,
+    'http_queue_depth': HTTP_QUEUE_DEPTH,
+    'http_processes': HTTP_PROCESSES,
+    'template_watch': TEMPLATE_WATCH,
+    'mqtt_workers': MQTT_WORKERS,
+    'mqtt_queue_size': MQTT_QUEUE_SIZE,
+    # Subscribe as $share/<group>/<topic> so several instances split requests
+    'mqtt_share_group': '',
+}
+
+# Upper bounds (seconds) of the latency histogram buckets in /api/metrics
+METRICS_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Metrics:
+    """Counters and histograms rendered in the Prometheus text format
+    
+    Each thread updates its own shard without taking a lock; shards are only
+    summed when the metrics are rendered. Callback metrics (queue depth,
+    cache ratios, ...) are read from their callbacks at that time.
+    """
+    
+    def __init__(self):
+        # name -> (type, help text, histogram buckets)
+        self._meta = OrderedDict()
+        self._callbacks = {}
+        self._local = threading.local()
+        # (thread, shard) of live threads; shards of finished threads are
+        # folded into _retired
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+    
+    def counter(self, name, help_text):
+        self._meta[name] = ('counter', help_text, None)
+    
+    def histogram(self, name, help_text, buckets=METRICS_LATENCY_BUCKETS):
+        self._meta[name] = ('histogram', help_text, tuple(buckets))
+    
+    def callback(self, name, help_text, func, kind='gauge'):
+        """Metric read from func() at render time: a number or {labels: number}"""
+        self._meta[name] = (kind, help_text, None)
+        self._callbacks[name] = func
+    
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+    
+    def inc(self, name, labels=(), value=1):
+        """Add value to a counter; labels is a tuple of (name, value) pairs"""
+        shard = self._shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + value
+    
+    def observe(self, name, value, labels=()):
+        """Record value in a histogram"""
+        shard = self._shard()
+        key = (name, labels)
+        counts = shard.get(key)
+        if counts is None:
+            # One count per bucket plus +Inf, then the sum
+            counts = shard[key] = [0] * (len(self._meta[name][2]) + 2)
+        counts[bisect.bisect_left(self._meta[name][2], value)] += 1
+        counts[-1] += value
+    
+    @staticmethod
+    def _merge(totals, shard):
+        for key, value in list(shard.items()):
+            if isinstance(value, list):
+                total = totals.setdefault(key, [0] * len(value))
+                for i, count in enumerate(value):
+                    total[i] += count
+            else:
+                totals[key] = totals.get(key, 0) + value
+    
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ''
+        pairs = []
+        for key, value in labels:
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            pairs.append(f'{key}="{value}"')
+        return '{' + ','.join(pairs) + '}'
+    
+    def render(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)"""
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    self._merge(self._retired, shard)
+            self._shards = live
+            totals = {}
+            self._merge(totals, self._retired)
+        for thread, shard in live:
+            self._merge(totals, shard)
+        
+        by_name = {}
+        for (name, labels), value in totals.items():
+            by_name.setdefault(name, []).append((labels, value))
+        
+        lines = []
+        for name, (kind, help_text, buckets) in self._meta.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if name in self._callbacks:
+                try:
+                    value = self._callbacks[name]()
+                except Exception:
+                    continue
+                samples = value.items() if isinstance(value, dict) else [((), value)]
+                for labels, sample in samples:
+                    lines.append(f"{name}{self._labels(labels)} {sample}")
+                continue
+            for labels, value in sorted(by_name.get(name, [])):
+                if kind != 'histogram':
+                    lines.append(f"{name}{self._labels(labels)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), value[:-1]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(labels)} {value[-1]}")
+                lines.append(f"{name}_count{self._labels(labels)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+METRICS = Metrics()
+METRICS.counter('esl_http_requests_total', "HTTP requests by endpoint, method and status")
+METRICS.histogram('esl_http_request_duration_seconds', "HTTP request handling time by endpoint")
+METRICS.counter('esl_http_response_bytes_total', "HTTP response body bytes by endpoint")
+METRICS.counter('esl_mqtt_messages_received_total', "MQTT messages received by command")
+METRICS.counter('esl_mqtt_messages_published_total', "MQTT messages published by command")
+METRICS.histogram('esl_mqtt_tmpllist_duration_seconds', "Time to answer a tmpllist request")
+
+# Commands counted separately in the MQTT metrics; others are 'other'
+METRICS_COMMANDS = ('tmpllist', 'wtag')
+
+def command_labels(command):
+    """Metric labels of an MQTT command"""
+    return (('command', command if command in METRICS_COMMANDS else 'other'),)
+
+class TemplateHTTPHandler(BaseHTTPRequestHandler):
+    """HTTP handler for template file serving"""
+    
+    protocol_version = 'HTTP/1.1' if HTTP_KEEPALIVE else 'HTTP/1.0'
+    # Idle timeout for persistent connections (applied to the socket in setup)
+    timeout = HTTP_KEEPALIVE_TIMEOUT
+    max_keepalive_requests = HTTP_KEEPALIVE_MAX_REQUESTS
+    # Headers and body are written separately; with Nagle's algorithm the body
+    # of a keep-alive response waits for the client's delayed ACK (~40 ms)
+    disable_nagle_algorithm = True
+    # Endpoint label of each path in /api/metrics; other paths are 'other'
+    metric_endpoints = {
+        '/api/res/templ/loadtemple': 'loadtemple',
+        '/api/res/templ/list': 'list',
+        '/api/health': 'health',
+        '/api/metrics': 'metrics',
+    }
+    
+    def __init__(self, *args, template_manager=None, requests_handled=0, **kwargs):
+        self.template_manager = template_manager
+        # Counted across workers when a pooled connection was parked in between
+        self.requests_handled = requests_handled
+        # Set when the connection is idle and should be parked, not closed
+        self.keep_idle = False
+        self._sending_error = False
+        self._status = None
+        self._started = 0.0
+        self._body_bytes = 0
+        super().__init__(*args, **kwargs)
+    
+    def handle_one_request(self):
+        """Handle one request and record it in the metrics"""
+        self._status = None
+        if not self.wait_for_request():
+            self.close_connection = True
+            return
+        super().handle_one_request()
+        if self._status is None:
+            # Connection closed or timed out before a request arrived
+            return
+        endpoint = (('endpoint', self.metric_endpoints.get(getattr(self, 'path', '').split('?', 1)[0], 'other')),)
+        METRICS.inc('esl_http_requests_total', endpoint + (('method', self.command or ''), ('status', self._status)))
+        METRICS.observe('esl_http_request_duration_seconds', time.perf_counter() - self._started, endpoint)
+        if self._body_bytes:
+            METRICS.inc('esl_http_response_bytes_total', endpoint, self._body_bytes)
+    
+    def wait_for_request(self):
+        """Wait for the next request on a persistent connection, False to stop
+        
+        With a worker pool an idle connection would keep a worker from
+        serving queued connections, so after a short wait (none when
+        connections are queued) the connection is marked keep_idle and the
+        server parks it until the client sends the next request.
+        """
+        if not self.requests_handled or not hasattr(self.server, 'park'):
+            return True
+        # A request may already be buffered; peek without blocking
+        self.connection.setblocking(False)
+        try:
+            pending = self.rfile.peek(1)
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+        if pending:
+            return True
+        # Readable also means closed by the client; the normal read handles that
+        if (not self.server.queued_connections()
+                and select.select([self.connection], [], [], HTTP_POOL_PARK_DELAY)[0]):
+            return True
+        self.keep_idle = True
+        return False
+    
+    def parse_request(self):
+        self._started = time.perf_counter()
+        self._body_bytes = 0
+        return super().parse_request()
+    
+    def send_header(self, keyword, value):
+        if keyword == 'Content-Length':
+            self._body_bytes = int(value)
+        super().send_header(keyword, value)
+    
+    def send_response(self, code, message=None):
+        """Send the status line and connection management headers"""
+        super().send_response(code, message)
+        self._status = code
+        self.requests_handled += 1
+        if self._sending_error or self.close_connection:
+            # send_error adds its own 'Connection: close'
+            return
+        
+        limit = self.max_keepalive_requests
+        if not getattr(self.server, 'keep_alive', True) or (limit and self.requests_handled >= limit):
+            self.send_header('Connection', 'close')
+        elif self.protocol_version >= 'HTTP/1.1':
+            remaining = f", max={limit - self.requests_handled}" if limit else ""
+            self.send_header('Keep-Alive', f"timeout={self.timeout}{remaining}")
+    
+    def send_error(self, code, message=None, explain=None):
+        self._sending_error = True
+        try:
+            super().send_error(code, message, explain)
+        finally:
+            self._sending_error = False
+    
+    def do_POST(self):
+        """Handle POST requests for template loading"""
+        try:
+            if HTTP_DEBUG_LEVEL >= 1:
+                # Log the request with detailed headers
+                self.log_message("=== POST REQUEST DEBUG ===")
+                self.log_message("Client: %s:%s", self.client_address[0], self.client_address[1])
+                self.log_message("Path: %s", self.path)
+                self.log_message("Headers: %s", dict(self.headers))
+            
+            # Get content length
+            try:
+                content_length = int(self.headers.get('Content-Length', 0))
+            except ValueError:
+                self.send_error(400, "Invalid Content-Length header")
+                return
+            
+            # Read the request body
+            if content_length <= 0:
+                self.log_message("ERROR: Empty request body (Content-Length = 0)")
+                self.send_error(400, "Empty request body")
+                return
+            if content_length > HTTP_MAX_BODY_SIZE:
+                self.log_message("ERROR: Request body too large (%d bytes)", content_length)
+                self.send_error(413, f"Request body too large: {content_length} > {HTTP_MAX_BODY_SIZE} bytes")
+                return
+            
+            post_data = self.read_body(content_length)
+            
+            if HTTP_DEBUG_LEVEL >= 2:
+                # Log detailed data information
+                self.log_message("Bytes expected: %d, Bytes received: %d", content_length, len(post_data))
+                self.log_message("Raw POST data (hex): %s", post_data.hex())
+                self.log_message("Raw POST data (repr): %r", post_data)
+            
+            # Check if we received all expected data
+            if len(post_data) != content_length:
+                self.log_message("ERROR: Data length mismatch - expected %d, got %d", content_length, len(post_data))
+                self.send_error(400, f"Data length mismatch: expected {content_length}, got {len(post_data)}")
+                return
+            
+            # Decode and parse JSON
+            data_str = None
+            try:
+                data_str = post_data.decode('utf-8')
+                
+                # Check for common issues
+                if not data_str.strip():
+                    self.log_message("ERROR: Decoded string is empty or whitespace only")
+                    self.send_error(400, "Empty JSON data")
+                    return
+                
+                try:
+                    # Fast path: well-formed JSON
+                    data = json_loads(data_str)
+                except json.JSONDecodeError:
+                    if not HTTP_JSON_REPAIR:
+                        raise
+                    fixed_str = repair_json(data_str)
+                    self.log_message("Fixed JSON format: %r", fixed_str)
+                    data = json_loads(fixed_str)
+                
+                if HTTP_DEBUG_LEVEL >= 2:
+                    self.log_message("Parsed JSON successfully: %s", json_pretty(data))
+                
+            except UnicodeDecodeError as e:
+                self.log_message("Unicode decode error: %s", str(e))
+                self.log_message("Problematic bytes: %r", bytes(post_data[:256]))
+                self.send_error(400, f"Unicode decode error: {str(e)}")
+                return
+            except json.JSONDecodeError as e:
+                self.log_message("JSON decode error: %s", str(e))
+                self.log_message("Problematic string: %r", data_str[:256] if data_str is not None else 'N/A')
+                self.send_error(400, f"Invalid JSON: {str(e)}")
+                return
+            
+            if not isinstance(data, dict):
+                self.send_error(400, "JSON body must be an object")
+                return
+            
+            # Handle template loading request
+            if self.path == '/api/res/templ/loadtemple':
+                name = data.get('name')
+                template_id = data.get('id')
+                if template_id is not None and not isinstance(template_id, str):
+                    template_id = str(template_id)
+                
+                self.log_message("Template request - name: %s, id: %s", name, template_id)
+                
+                if not name and not template_id:
+                    self.send_error(400, "Missing 'name' or 'id' parameter")
+                    return
+                
+                # Find template file
+                template_info = self.template_manager.find_template_info(name=name, template_id=template_id)
+                
+                if not template_info:
+                    self.log_message("Template not found: name=%s, id=%s", name, template_id)
+                    self.send_error(404, f"Template not found: {name or template_id}")
+                    return
+                
+                template_path = template_info['filepath']
+                etag = f'"{template_info["md5"]}"'
+                
+                # The requester already holds this exact file (in any encoding)
+                matched = self.etag_matches(etag)
+                if matched:
+                    self.send_not_modified(matched)
+                    self.log_message("Template not modified: %s", template_info['filename'])
+                    return
+                
+                # Read and send template file (served from memory when cached,
+                # streamed from disk with sendfile otherwise)
+                try:
+                    # Get filename for Content-Disposition header
+                    filename = os.path.basename(template_path)
+                    
+                    # Handle filename encoding for HTTP headers
+                    try:
+                        # Try ASCII encoding first
+                        filename.encode('ascii')
+                        disposition = f'attachment; filename="{filename}"'
+                    except UnicodeEncodeError:
+                        # Use RFC 5987 encoding for non-ASCII filenames
+                        from urllib.parse import quote
+                        encoded_filename = quote(filename, safe='')
+                        disposition = f"attachment; filename*=UTF-8''{encoded_filename}"
+                    
+                    range_header = self.headers.get('Range')
+                    if_range = self.headers.get('If-Range')
+                    if if_range and if_range.strip() != etag:
+                        # The client's partial copy is outdated, send everything
+                        range_header = None
+                    
+                    if self.template_manager.should_stream(template_info):
+                        with open(template_path, 'rb') as f:
+                            size = os.fstat(f.fileno()).st_size
+                            span = self.resolve_range(range_header, size)
+                            if span is False:
+                                return
+                            start, length = span or (0, size)
+                            self.send_template_headers(disposition, etag, size, span, 'identity')
+                            if length:
+                                self.connection.sendfile(f, start, length)
+                        encoding = 'identity'
+                    else:
+                        variants = self.template_manager.read_template_variants(template_path)
+                        # Reading may have rescanned a file changed since the last scan
+                        current = self.template_manager.templates.get(template_info['filename'])
+                        if current is not None and current['md5'] != template_info['md5']:
+                            etag = f'"{current["md5"]}"'
+                        # Ranges always refer to the uncompressed file
+                        if range_header:
+                            encoding = 'identity'
+                        else:
+                            encoding = negotiate_encoding(self.headers.get('Accept-Encoding'), variants)
+                        content = variants[encoding]
+                        span = self.resolve_range(range_header, len(content))
+                        if span is False:
+                            return
+                        start, length = span or (0, len(content))
+                        self.send_template_headers(disposition, etag, len(content), span, encoding)
+                        self.wfile.write(memoryview(content)[start:start + length])
+                    
+                    self.log_message("Template sent successfully: %s (%s, %d bytes)", filename, encoding, length)
+                    
+                except Exception as e:
+                    self.log_message("Error reading template file: %s", str(e))
+                    self.send_error(500, f"Error reading template file: {str(e)}")
+                    return
+            else:
+                self.send_error(404, "Endpoint not found")
+                
+        except Exception as e:
+            self.log_message("Unexpected error in do_POST: %s", str(e))
+            self.send_error(500, f"Internal server error: {str(e)}")
+            return
+    
+    def do_OPTIONS(self):
+        """Handle OPTIONS requests for CORS preflight"""
+        self.log_message("OPTIONS request received from %s for path %s", self.client_address[0], self.path)
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Content-Length, If-None-Match, Range, If-Range')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+    
+    def read_body(self, content_length):
+        """Read exactly content_length bytes (or fewer if the client hangs up) into one buffer"""
+        buffer = bytearray(content_length)
+        view = memoryview(buffer)
+        bytes_read = 0
+        while bytes_read < content_length:
+            n = self.rfile.readinto(view[bytes_read:])
+            if not n:
+                self.log_message("WARNING: Connection closed before all data received")
+                break
+            bytes_read += n
+        view.release()
+        if bytes_read < content_length:
+            del buffer[bytes_read:]
+        return buffer
+    
+    def resolve_range(self, range_header, size):
+        """Turn a Range header into (start, length), None for the whole file
+        
+        Sends 416 and returns False if the range cannot be satisfied.
+        """
+        try:
+            return parse_byte_range(range_header, size)
+        except ValueError:
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{size}')
+            self.send_header('Content-Length', '0')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            return False
+    
+    def send_template_headers(self, disposition, etag, size, span, encoding):
+        """Send status and headers for a full (200) or partial (206) template body"""
+        if span:
+            start, length = span
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{start + length - 1}/{size}')
+        else:
+            length = size
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Disposition', disposition)
+        self.send_header('Content-Length', str(length))
+        if encoding != 'identity':
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', variant_etag(etag, encoding))
+        self.send_header('Cache-Control', 'no-cache')
+        # Add CORS headers
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, If-None-Match, Range, If-Range')
+        self.send_header('Access-Control-Expose-Headers', 'ETag, Content-Range')
+        self.end_headers()
+    
+    def etag_matches(self, etag):
+        """Check the request's If-None-Match header against etag
+        
+        The tags of the compressed variants of etag match as well. Returns
+        the matching tag (to send back with the 304), None if none matches.
+        """
+        header = self.headers.get('If-None-Match')
+        if not header:
+            return None
+        variants = {variant_etag(etag, encoding) for encoding in ETAG_ENCODING_SUFFIXES}
+        for candidate in header.split(','):
+            candidate = candidate.strip()
+            if candidate.startswith('W/'):
+                candidate = candidate[2:]
+            if candidate == '*' or candidate == etag:
+                return etag
+            if candidate in variants:
+                return candidate
+        return None
+    
+    def send_not_modified(self, etag):
+        """Send a 304 response without body"""
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Expose-Headers', 'ETag')
+        self.end_headers()
+
+    def do_GET(self):
+        """Handle GET requests for template listing"""
+        self.log_message("GET request received from %s for path %s", self.client_address[0], self.path)
+        
+        parsed = urlparse(self.path)
+        if parsed.path == '/api/res/templ/list':
+            try:
+                self.send_template_list(parse_qs(parsed.query))
+            except Exception as e:
+                self.send_error(500, f"Internal server error: {str(e)}")
+        elif parsed.path == '/api/metrics':
+            response = METRICS.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+        elif parsed.path == '/api/health':
+            # Health check endpoint
+            health = {
+                "status": "ok",
+                "message": "Server is running",
+                "json_codec": JSON_CODEC,
+                "cache": self.template_manager.get_cache_stats()
+            }
+            # Stats registered by the server core (e.g. MQTT workers)
+            for key, provider in getattr(self.server, 'health_providers', {}).items():
+                health[key] = provider()
+            response = json_dumps(health)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(response)))
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(response)
+        else:
+            self.send_error(404, "Endpoint not found")
+    
+    def send_template_list(self, query):
+        """Send the pre-rendered template list, or a page / delta of it
+        
+        Without query parameters the full list (a JSON array) is sent from
+        bytes rendered when the table last changed. With since, offset or
+        limit a JSON object with the matching templates is sent instead.
+        """
+        listing = self.template_manager.listing
+        if not any(key in query for key in ('since', 'offset', 'limit')):
+            etag = listing.etag
+            encoding = negotiate_encoding(self.headers.get('Accept-Encoding'), listing.variants)
+            body = listing.variants[encoding]
+        else:
+            try:
+                since = int(query['since'][0]) if 'since' in query else None
+                offset = int(query.get('offset', ['0'])[0])
+                limit = int(query['limit'][0]) if 'limit' in query else None
+                if offset < 0 or (limit is not None and limit < 0):
+                    raise ValueError
+            except ValueError:
+                self.send_error(400, "since, offset and limit must be non-negative integers")
+                return
+            # Tagged by the slice it covers, so a 304 never validates another page
+            etag = listing.page_etag(since, offset, limit)
+            body = None
+            encoding = 'identity'
+        
+        matched = self.etag_matches(etag)
+        if matched:
+            self.send_not_modified(matched)
+            return
+        if body is None:
+            body = json_dumps(listing.page(since, offset, limit))
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if encoding != 'identity':
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('ETag', variant_etag(etag, encoding))
+        self.send_header('X-Template-Version', str(listing.version))
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Expose-Headers', 'ETag, X-Template-Version')
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        """Override to enable logging for debugging"""
+        message = format % args
+        # Log to template manager if available, to the console otherwise
+        if self.template_manager and self.template_manager.logger:
+            self.template_manager.log_request(message)
+        else:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] HTTP: {message}")
+
+# Patterns used to repair JSON written by hand in curl commands
+_JSON_FIRST_KEY = re.compile(r'\{(\w+):')
+_JSON_NEXT_KEY = re.compile(r',(\w+):')
+_JSON_BARE_VALUE = re.compile(r':([^",\{\}\[\]]+)([,\}])')
+
+JSON_CODEC = 'orjson' if orjson else 'ujson' if ujson else 'json'
+
+def json_dumps(obj):
+    """Compact UTF-8 JSON bytes for the wire (MQTT payloads, HTTP bodies)"""
+    try:
+        if orjson:
+            return orjson.dumps(obj)
+        if ujson:
+            return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False).encode('utf-8')
+    except (TypeError, OverflowError):
+        # e.g. integers beyond 64 bits; the json module handles them
+        pass
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def json_loads(data):
+    """Parse JSON from str or bytes, raising json.JSONDecodeError like json.loads"""
+    try:
+        if orjson:
+            return orjson.loads(data)
+        if ujson:
+            return ujson.loads(data)
+    except ValueError:
+        # Let the json module produce its usual error (or accept what the
+        # fast parser is stricter about, e.g. NaN)
+        pass
+    return json.loads(data)
+
+def json_pretty(obj):
+    """Indented JSON text for logs"""
+    return json.dumps(obj, indent=2, ensure_ascii=False)
+
+def repair_json(data_str):
+    """Fix common JSON format issues in hand-written request bodies"""
+    data_str = data_str.strip()
+    
+    # Remove outer single quotes if present
+    if data_str.startswith("'") and data_str.endswith("'"):
+        data_str = data_str[1:-1]
+    
+    # Fix missing quotes around keys and values (common curl mistake)
+    # Replace {key: with {"key":
+    data_str = _JSON_FIRST_KEY.sub(r'{"\1":', data_str)
+    # Replace ,key: with ,"key":
+    data_str = _JSON_NEXT_KEY.sub(r',"\1":', data_str)
+    # Replace :value} with :"value"} for unquoted string values
+    # This regex looks for :word} or :word, patterns and adds quotes
+    data_str = _JSON_BARE_VALUE.sub(r':"\1"\2', data_str)
+    return data_str
+
+def parse_byte_range(range_header, size):
+    """Parse a single 'bytes=' Range header against a body of size bytes
+    
+    Returns (start, length), or None when there is no usable range (missing,
+    other units or multiple ranges, which are answered with the full body).
+    Raises ValueError if the range cannot be satisfied.
+    """
+    if not range_header:
+        return None
+    unit, _, ranges = range_header.strip().partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in ranges:
+        return None
+    first, sep, last = ranges.strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(size - int(last), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    if start < 0 or start >= size or end < start:
+        raise ValueError("Unsatisfiable range")
+    end = min(end, size - 1)
+    return start, end - start + 1
+
+class RobustHTTPServer(HTTPServer):
+    """HTTPServer with socket options tuned for potential network issues
+    
+    With reuse_port several processes can listen on the same port and the
+    kernel spreads new connections over them (SO_REUSEPORT).
+    """
+    # Whether handlers may keep connections open between requests
+    keep_alive = True
+    
+    def __init__(self, server_address, RequestHandlerClass, bind_and_activate=True, reuse_port=False):
+        self.reuse_port = reuse_port
+        super().__init__(server_address, RequestHandlerClass, bind_and_activate)
+        # Set socket options for better network compatibility
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # Increase buffer sizes for better network performance
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 65536)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 65536)
+    
+    def server_bind(self):
+        if self.reuse_port:
+            # Must be set before bind; every process sharing the port sets it
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+class SingleHTTPServer(RobustHTTPServer):
+    """HTTP server handling one connection at a time
+    
+    Every connection is closed after its request: an idle persistent
+    connection would block all other clients until the keep-alive timeout.
+    """
+    keep_alive = False
+
+class ThreadedHTTPServer(socketserver.ThreadingMixIn, RobustHTTPServer):
+    """HTTP server that starts a new thread for every connection"""
+    daemon_threads = True
+
+class PooledHTTPServer(RobustHTTPServer):
+    """HTTP server that hands connections to a bounded pool of worker threads
+    
+    Idle persistent connections do not keep their worker: the handler gives
+    them back (keep_idle) and they wait in a selector until the client sends
+    its next request or the keep-alive timeout passes.
+    """
+    
+    def __init__(self, server_address, RequestHandlerClass, max_connections=HTTP_MAX_CONNECTIONS,
+                 queue_depth=HTTP_QUEUE_DEPTH, bind_and_activate=True, reuse_port=False):
+        self.max_connections = max(1, int(max_connections))
+        self.queue_depth = max(1, int(queue_depth))
+        # Let the kernel backlog absorb bursts of the same size as our queue
+        self.request_queue_size = max(self.request_queue_size, self.queue_depth)
+        self.rejected_connections = 0
+        self._pending = queue.Queue(maxsize=self.queue_depth)
+        self._workers = []
+        self._closing = False
+        # Parked idle connections; the socket pair wakes the selector up
+        self._idle = selectors.DefaultSelector()
+        self._idle_lock = threading.Lock()
+        self._wakeup, self._wakeup_sender = socket.socketpair()
+        self._idle.register(self._wakeup, selectors.EVENT_READ)
+        super().__init__(server_address, RequestHandlerClass, bind_and_activate, reuse_port)
+        
+        for i in range(self.max_connections):
+            worker = threading.Thread(target=self._worker_loop, name=f"http-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        threading.Thread(target=self._idle_loop, name="http-idle", daemon=True).start()
+    
+    def process_request(self, request, client_address, requests_handled=0):
+        """Queue the connection for a worker, or reject it when the queue is full"""
+        try:
+            self._pending.put_nowait((request, client_address, requests_handled))
+        except queue.Full:
+            self.rejected_connections += 1
+            self._reject_request(request)
+    
+    def finish_request(self, request, client_address, requests_handled=0):
+        """Serve a connection, returns the handler"""
+        if requests_handled:
+            return self.RequestHandlerClass(request, client_address, self, requests_handled=requests_handled)
+        return self.RequestHandlerClass(request, client_address, self)
+    
+    def park(self, request, client_address, requests_handled, timeout):
+        """Watch an idle persistent connection until its next request arrives"""
+        with self._idle_lock:
+            if self._closing:
+                self.shutdown_request(request)
+                return
+            self._idle.register(request, selectors.EVENT_READ,
+                                (client_address, requests_handled, time.monotonic() + timeout))
+        try:
+            self._wakeup_sender.send(b'\0')
+        except OSError:
+            pass
+    
+    def _idle_loop(self):
+        """Queue parked connections that became readable, close expired ones"""
+        next_expiry = time.monotonic() + 1.0
+        while not self._closing:
+            try:
+                events = self._idle.select(timeout=1.0)
+            except (OSError, ValueError):
+                break
+            for key, _ in events:
+                if key.fileobj is self._wakeup:
+                    try:
+                        self._wakeup.recv(4096)
+                    except OSError:
+                        pass
+                    continue
+                with self._idle_lock:
+                    self._idle.unregister(key.fileobj)
+                # Closed by the client: no need to queue it for a worker
+                try:
+                    alive = key.fileobj.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+                except BlockingIOError:
+                    alive = True
+                except OSError:
+                    alive = False
+                if alive:
+                    self.process_request(key.fileobj, key.data[0], key.data[1])
+                else:
+                    self.shutdown_request(key.fileobj)
+            
+            now = time.monotonic()
+            if now < next_expiry:
+                continue
+            next_expiry = now + 1.0
+            with self._idle_lock:
+                expired = [key for key in self._idle.get_map().values()
+                           if key.data is not None and key.data[2] <= now]
+                for key in expired:
+                    self._idle.unregister(key.fileobj)
+            for key in expired:
+                self.shutdown_request(key.fileobj)
+    
+    def _reject_request(self, request):
+        """Answer with 503 so the client retries later instead of hanging"""
+        try:
+            request.sendall(b"HTTP/1.0 503 Service Unavailable\r\n"
+                            b"Content-Type: text/plain\r\n"
+                            b"Content-Length: 11\r\n"
+                            b"Retry-After: 1\r\n"
+                            b"Connection: close\r\n\r\n"
+                            b"Server busy")
+        except OSError:
+            pass
+        self.shutdown_request(request)
+    
+    def _worker_loop(self):
+        """Serve queued connections until a stop marker is received"""
+        while True:
+            item = self._pending.get()
+            if item is None:
+                break
+            request, client_address, requests_handled = item
+            handler = None
+            try:
+                handler = self.finish_request(request, client_address, requests_handled)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                if getattr(handler, 'keep_idle', False):
+                    self.park(request, client_address, handler.requests_handled, handler.timeout)
+                else:
+                    self.shutdown_request(request)
+    
+    def queued_connections(self):
+        """Number of accepted connections still waiting for a worker"""
+        return self._pending.qsize()
+    
+    def idle_connections(self):
+        """Number of parked persistent connections waiting for their next request"""
+        return max(0, len(self._idle.get_map()) - 1)
+    
+    def server_close(self):
+        super().server_close()
+        # Close parked connections and those that never reached a worker,
+        # then stop the workers
+        with self._idle_lock:
+            self._closing = True
+            parked = [key.fileobj for key in self._idle.get_map().values() if key.data is not None]
+            for request in parked:
+                self._idle.unregister(request)
+        for request in parked:
+            self.shutdown_request(request)
+        try:
+            self._wakeup_sender.send(b'\0')
+        except OSError:
+            pass
+        while True:
+            try:
+                item = self._pending.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                self.shutdown_request(item[0])
+        for _ in self._workers:
+            self._pending.put(None)
+
+def create_http_server(server_address, RequestHandlerClass, mode=None,
+                       max_connections=None, queue_depth=None, reuse_port=False):
+    """Create the template HTTP server for the configured concurrency mode"""
+    mode = mode or HTTP_CONCURRENCY_MODE
+    if mode == 'single':
+        return SingleHTTPServer(server_address, RequestHandlerClass, reuse_port=reuse_port)
+    if mode == 'thread':
+        return ThreadedHTTPServer(server_address, RequestHandlerClass, reuse_port=reuse_port)
+    if mode == 'pool':
+        return PooledHTTPServer(
+            server_address, RequestHandlerClass,
+            max_connections=max_connections or HTTP_MAX_CONNECTIONS,
+            queue_depth=queue_depth or HTTP_QUEUE_DEPTH,
+            reuse_port=reuse_port,
+        )
+    raise ValueError(f"Unknown HTTP concurrency mode: {mode}")
+
+def describe_http_server(server):
+    """Short human readable description of the server concurrency mode"""
+    if hasattr(server, 'describe'):
+        return server.describe()
+    if isinstance(server, PooledHTTPServer):
+        return f"pool ({server.max_connections} workers, queue depth {server.queue_depth})"
+    if isinstance(server, ThreadedHTTPServer):
+        return "thread per connection"
+    return "single thread"
+
+class TemplateCache:
+    """LRU cache of template file contents bounded by a memory budget
+    
+    Entries are stored together with the (mtime, size, inode) signature of
+    the file they were read from; a lookup with a different signature is a
+    miss and drops the stale entry. Each entry holds the raw bytes under
+    'identity' plus any compressed variants ('gzip', 'zstd', 'br'), and
+    whether compression has already been attempted for it.
+    """
+    
+    def __init__(self, max_bytes=TEMPLATE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, filepath, signature):
+        """Return (variants, compressed) for filepath if they match signature"""
+        with self._lock:
+            entry = self._entries.get(filepath)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(filepath)
+                self.hits += 1
+                return entry[1], entry[2]
+            if entry is not None:
+                self._discard(filepath)
+            self.misses += 1
+            return None
+    
+    def put(self, filepath, signature, content):
+        """Store content for filepath, evicting least recently used entries"""
+        size = len(content)
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            self._discard(filepath)
+            self._make_room(size)
+            self._entries[filepath] = (signature, {'identity': content}, False)
+            self.current_bytes += size
+        return True
+    
+    def add_variants(self, filepath, signature, variants):
+        """Attach compressed variants to a cached entry of the same file version"""
+        with self._lock:
+            entry = self._entries.get(filepath)
+            if entry is None or entry[0] != signature:
+                return False
+            size = sum(len(content) for content in variants.values())
+            # Keep the entry itself out of the eviction candidates
+            self._entries.move_to_end(filepath)
+            self._make_room(size, keep=filepath)
+            if self.current_bytes + size > self.max_bytes:
+                variants, size = {}, 0
+            merged = dict(entry[1])
+            merged.update(variants)
+            self._entries[filepath] = (signature, merged, True)
+            self.current_bytes += size
+            return bool(variants)
+    
+    def _make_room(self, size, keep=None):
+        while self._entries and self.current_bytes + size > self.max_bytes:
+            filepath = next(iter(self._entries))
+            if filepath == keep:
+                break
+            self._discard(filepath)
+            self.evictions += 1
+    
+    def invalidate(self, filepath):
+        """Drop the cached content of a single file"""
+        with self._lock:
+            self._discard(filepath)
+    
+    def retain(self, filepaths):
+        """Drop cached content of files that are no longer templates"""
+        with self._lock:
+            for filepath in [p for p in self._entries if p not in filepaths]:
+                self._discard(filepath)
+    
+    def _discard(self, filepath):
+        entry = self._entries.pop(filepath, None)
+        if entry is not None:
+            self.current_bytes -= sum(len(content) for content in entry[1].values())
+    
+    def stats(self):
+        """Get cache counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+def compress_variants(content, encodings=None):
+    """Compress content with every available encoding
+    
+    Returns a dict of encoding -> bytes, leaving out encodings that do not
+    make the content smaller.
+    """
+    encodings = encodings or available_encodings()
+    variants = {}
+    for encoding in encodings:
+        if encoding == 'gzip':
+            compressed = gzip.compress(content, TEMPLATE_GZIP_LEVEL, mtime=0)
+        elif encoding == 'zstd' and zstandard is not None:
+            compressed = zstandard.ZstdCompressor(level=TEMPLATE_ZSTD_LEVEL).compress(content)
+        elif encoding == 'br' and brotli is not None:
+            compressed = brotli.compress(content, quality=TEMPLATE_BROTLI_QUALITY)
+        else:
+            continue
+        if len(compressed) < len(content):
+            variants[encoding] = compressed
+    return variants
+
+def available_encodings():
+    """Content encodings this installation can produce, most preferred first"""
+    encodings = []
+    if zstandard is not None:
+        encodings.append('zstd')
+    if brotli is not None:
+        encodings.append('br')
+    encodings.append('gzip')
+    return [encoding for encoding in encodings if encoding in TEMPLATE_COMPRESSION]
+
+def negotiate_encoding(accept_encoding, variants):
+    """Pick the best variant allowed by an Accept-Encoding header
+    
+    Returns the encoding name, or 'identity' when no compressed variant is
+    acceptable.
+    """
+    if not accept_encoding:
+        return 'identity'
+    accepted = {}
+    for part in accept_encoding.split(','):
+        fields = part.strip().split(';')
+        coding = fields[0].strip().lower()
+        q = 1.0
+        for param in fields[1:]:
+            key, _, value = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding:
+            accepted[coding] = q
+    
+    best = 'identity'
+    best_q = 0.0
+    for encoding in available_encodings():
+        if encoding not in variants:
+            continue
+        q = accepted.get(encoding, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+def variant_etag(etag, encoding):
+    """Entity tag of the encoding variant of the representation tagged etag"""
+    if encoding == 'identity':
+        return etag
+    return f'{etag[:-1]}-{ETAG_ENCODING_SUFFIXES.get(encoding, encoding)}"'
+
+class TemplateCompressor:
+    """Background worker that adds compressed variants to cached templates
+    
+    Compression runs once per template version on this worker, never on the
+    HTTP request path; until it finishes the template is served uncompressed.
+    """
+    
+    def __init__(self, cache):
+        self.cache = cache
+        self.compressed = 0
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+    
+    def schedule(self, filepath, signature, content):
+        """Queue a file version for compression unless it is already queued"""
+        key = (filepath, signature)
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="template-compressor", daemon=True)
+                self._thread.start()
+        self._queue.put((filepath, signature, content))
+    
+    def _run(self):
+        while True:
+            filepath, signature, content = self._queue.get()
+            try:
+                variants = compress_variants(content)
+                # Recorded even when empty so incompressible files are not retried
+                if self.cache.add_variants(filepath, signature, variants):
+                    self.compressed += 1
+            except Exception:
+                pass
+            finally:
+                with self._lock:
+                    self._pending.discard((filepath, signature))
+
+class ChecksumRegistry:
+    """Digests of template files, computed once per file version
+    
+    Every digest is stored with the (mtime, size, inode) signature of the
+    file it was computed from, so the MQTT and HTTP paths only hash a file
+    again after it has changed on disk.
+    """
+    
+    def __init__(self, fast_digest=TEMPLATE_FAST_DIGEST):
+        self.fast_digest = fast_digest
+        self.computed = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+    
+    def get(self, filepath, signature=None, content=None):
+        """Get the digests of filepath, hashing it only if it has changed
+        
+        Returns a dict with 'md5' and, when enabled, 'crc32'. If content is
+        given it must be the current file content and is hashed instead of
+        reading the file again.
+        """
+        if signature is None:
+            st = os.stat(filepath)
+            signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+        
+        entry = self._entries.get(filepath)
+        if entry is not None and entry[0] == signature:
+            return entry[1]
+        
+        if content is None:
+            with open(filepath, 'rb') as f:
+                content = f.read()
+        digests = {'md5': hashlib.md5(content).hexdigest()}
+        if self.fast_digest:
+            digests['crc32'] = format(zlib.crc32(content) & 0xffffffff, '08x')
+        
+        with self._lock:
+            self._entries[filepath] = (signature, digests)
+            self.computed += 1
+        return digests
+    
+    def peek(self, filepath, signature):
+        """Get stored digests without hashing, or None if not known"""
+        entry = self._entries.get(filepath)
+        if entry is not None and entry[0] == signature:
+            return entry[1]
+        return None
+    
+    def retain(self, filepaths):
+        """Forget digests of files that are no longer templates"""
+        with self._lock:
+            for filepath in [p for p in self._entries if p not in filepaths]:
+                del self._entries[filepath]
+
+class TemplateIndex:
+    """Lookup tables over one template table, built once per scan
+    
+    A new index is built for every scan and swapped in as a whole, so
+    lookups always see a consistent set of tables.
+    """
+    
+    def __init__(self, templates, fuzzy_index=TEMPLATE_FUZZY_INDEX):
+        self.by_id = {}
+        self.by_name = {}
+        self.by_filename = {}
+        self.by_stem = {}
+        self.trigrams = {} if fuzzy_index else None
+        # Scan order, used to pick the first fuzzy match like the old linear scan
+        self.order = []
+        
+        for position, (filename, info) in enumerate(templates.items()):
+            self.order.append(info)
+            self.by_id.setdefault(info['id'], info)
+            self.by_name.setdefault(info['name'], info)
+            self.by_filename.setdefault(filename, info)
+            self.by_stem.setdefault(filename.replace('.json', ''), info)
+            if self.trigrams is not None:
+                for gram in self._grams(filename) | self._grams(info['name']):
+                    self.trigrams.setdefault(gram, []).append(position)
+    
+    @staticmethod
+    def _grams(text):
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+    
+    def find(self, name=None, template_id=None):
+        """Find template info by ID, exact name/filename, stem, then substring"""
+        if template_id:
+            info = self.by_id.get(template_id)
+            if info:
+                return info
+        if not name:
+            return None
+        
+        info = self.by_name.get(name) or self.by_filename.get(name) or self.by_stem.get(name)
+        if info:
+            return info
+        return self._find_substring(name)
+    
+    def _find_substring(self, name):
+        """First template (in scan order) whose filename or name contains name"""
+        if self.trigrams is None or len(name) < 3:
+            candidates = range(len(self.order))
+        else:
+            postings = []
+            for gram in self._grams(name):
+                positions = self.trigrams.get(gram)
+                if not positions:
+                    return None
+                postings.append(positions)
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for positions in postings[1:]:
+                candidates.intersection_update(positions)
+            candidates = sorted(candidates)
+        
+        for position in candidates:
+            info = self.order[position]
+            if name in info['filename'] or name in info['name']:
+                return info
+        return None
+
+class TemplateListing:
+    """Template list of one table version, pre-rendered for /api/res/templ/list
+    
+    changed_at maps each filename to the version it was added or last changed
+    in, removed_at each removed filename to the version it was removed in;
+    since queries older than floor cannot be answered as a delta.
+    """
+    
+    def __init__(self, version, templates, changed_at, removed_at, floor):
+        self.version = version
+        self.templates = list(templates.values())
+        self.changed_at = dict(changed_at)
+        self.removed_at = dict(removed_at)
+        self.floor = floor
+        body = json_dumps(self.templates)
+        self.etag = f'"{hashlib.md5(body).hexdigest()}"'
+        self.variants = {'identity': body}
+        self.variants.update(compress_variants(body))
+    
+    def page_key(self, since=None, offset=0, limit=None):
+        """Normalised (since, offset, end) of a page; since is None for the full list"""
+        if since is not None and (since < self.floor or since > self.version):
+            since = None
+        return since, offset, None if limit is None else offset + limit
+    
+    def page_etag(self, since=None, offset=0, limit=None):
+        """Entity tag of page(since, offset, limit), without rendering it"""
+        key = f"{self.etag}:{self.version}:{self.page_key(since, offset, limit)}"
+        return f'"{hashlib.md5(key.encode()).hexdigest()}"'
+    
+    def page(self, since=None, offset=0, limit=None):
+        """Templates changed after version since (all if None), sliced by offset/limit"""
+        since, offset, end = self.page_key(since, offset, limit)
+        full = since is None
+        if full:
+            templates = self.templates
+            removed = []
+        else:
+            templates = [info for info in self.templates if self.changed_at.get(info['filename'], 0) > since]
+            removed = [filename for filename, version in self.removed_at.items() if version > since]
+        return {
+            'version': self.version,
+            'full': full,
+            'total': len(templates),
+            'offset': offset,
+            'templates': templates[offset:end],
+            'removed': removed,
+        }
+
+class TemplateManager:
+    """Template file management system
+    
+    A read_only manager (for lookups by tools) never creates the resource
+    directory or writes the ID manifest.
+    """
+    
+    def __init__(self, resource_dir, logger=None, cache_max_bytes=TEMPLATE_CACHE_MAX_BYTES, read_only=False):
+        self.resource_dir = resource_dir
+        self.logger = logger
+        self.read_only = read_only
+        self.templates = {}
+        self.index = TemplateIndex({})
+        # (mtime, size, inode) of every template file as of the last scan
+        self.signatures = {}
+        # Signatures of files that failed to load, so they are only reported once
+        self._failed = {}
+        # filename -> template ID, persisted in the manifest file
+        self.manifest_path = os.path.join(resource_dir, TEMPLATE_MANIFEST_NAME)
+        self.manifest = {}
+        self._manifest_signature = None
+        self._scan_lock = threading.RLock()
+        self.cache = TemplateCache(cache_max_bytes) if cache_max_bytes > 0 else None
+        self.compressor = TemplateCompressor(self.cache) if self.cache else None
+        self.checksums = ChecksumRegistry()
+        # Bumped whenever the template table changes; starts from the clock so
+        # it keeps increasing across restarts
+        self.version = time.time_ns() // 1000000
+        self._changed_at = {}
+        self._removed_at = OrderedDict()
+        self._listing_floor = self.version
+        self.listing = TemplateListing(self.version, {}, {}, {}, self.version)
+        self.ensure_resource_dir()
+        self.scan_templates()
+    
+    def ensure_resource_dir(self):
+        """Ensure resource directory exists"""
+        if not self.read_only and not os.path.exists(self.resource_dir):
+            os.makedirs(self.resource_dir)
+    
+    def scan_templates(self, filenames=None):
+        """Scan resource directory for template files
+        
+        The scan is incremental: directory entries are compared with the
+        (mtime, size, inode) signatures of the previous scan and only added
+        or changed files are read, parsed and hashed. When filenames is
+        given only those files are checked and the rest of the table is kept
+        as is. Returns a dict with the 'added', 'changed' and 'removed'
+        filenames.
+        """
+        with self._scan_lock:
+            return self._scan(filenames)
+    
+    def _scan(self, filenames):
+        previous = self.templates
+        previous_signatures = self.signatures
+        changes = {'added': [], 'changed': [], 'removed': []}
+        manifest_reloaded = self._load_manifest()
+        
+        # Build a new table and swap it in so concurrent HTTP workers never
+        # iterate over a half-filled dict
+        if filenames is None:
+            templates = {}
+            signatures = {}
+            failed = {}
+            try:
+                entries = [(entry.name, entry.stat) for entry in os.scandir(self.resource_dir)]
+            except FileNotFoundError:
+                entries = []
+        else:
+            templates = dict(previous)
+            signatures = dict(previous_signatures)
+            failed = dict(self._failed)
+            entries = []
+            for filename in filenames:
+                filepath = os.path.join(self.resource_dir, filename)
+                failed.pop(filepath, None)
+                entries.append((filename, functools.partial(os.stat, filepath)))
+        
+        for filename, stat_entry in entries:
+            if not filename.endswith('.json'):
+                continue
+            filepath = os.path.join(self.resource_dir, filename)
+            signature = None
+            try:
+                try:
+                    st = stat_entry()
+                except FileNotFoundError:
+                    self._drop_entry(templates, signatures, filename, filepath)
+                    continue
+                if not stat.S_ISREG(st.st_mode):
+                    self._drop_entry(templates, signatures, filename, filepath)
+                    continue
+                signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+                
+                info = previous.get(filename)
+                if info is not None and previous_signatures.get(filepath) == signature:
+                    # Unchanged since the last scan
+                    templates[filename] = info
+                    signatures[filepath] = signature
+                    continue
+                if self._failed.get(filepath) == signature:
+                    # Still the same broken file, already reported
+                    self._drop_entry(templates, signatures, filename, filepath)
+                    failed[filepath] = signature
+                    continue
+                
+                info, signature = self._load_template(filename, filepath)
+                templates[filename] = info
+                signatures[filepath] = signature
+                changes['changed' if filename in previous else 'added'].append(filename)
+            except Exception as e:
+                self._drop_entry(templates, signatures, filename, filepath)
+                failed[filepath] = signature
+                if self.logger:
+                    self.logger(f"Error scanning template {filename}: {str(e)}", "ERROR")
+        
+        if manifest_reloaded:
+            # Pinned IDs may have changed for files that are otherwise unchanged
+            for filename, info in templates.items():
+                if info['id'] != self.template_id(filename):
+                    templates[filename] = dict(info, id=self.template_id(filename))
+                    if filename not in changes['added'] and filename not in changes['changed']:
+                        changes['changed'].append(filename)
+        
+        changes['removed'] = [filename for filename in previous if filename not in templates]
+        self._failed = failed
+        if not self.read_only:
+            # A full scan drops manifest entries of files that are gone (files
+            # that failed to load keep theirs)
+            keep = None
+            if filenames is None:
+                keep = set(templates) | {os.path.basename(filepath) for filepath in failed}
+            self._save_manifest(templates, keep)
+        
+        if not (changes['added'] or changes['changed'] or changes['removed']):
+            return changes
+        
+        index = TemplateIndex(templates)
+        self.templates = templates
+        self.index = index
+        self.signatures = signatures
+        self.version += 1
+        self._update_listing(templates, changes)
+        if self.cache:
+            self.cache.retain(signatures)
+        self.checksums.retain(signatures)
+        return changes
+    
+    def _update_listing(self, templates, changes):
+        """Record the changes under the new version and render the template list"""
+        for filename in changes['added'] + changes['changed']:
+            self._changed_at[filename] = self.version
+            self._removed_at.pop(filename, None)
+        for filename in changes['removed']:
+            self._changed_at.pop(filename, None)
+            self._removed_at.pop(filename, None)
+            self._removed_at[filename] = self.version
+        while len(self._removed_at) > TEMPLATE_LIST_MAX_REMOVED:
+            filename, version = self._removed_at.popitem(last=False)
+            self._listing_floor = version
+        self.listing = TemplateListing(self.version, templates, self._changed_at,
+                                       self._removed_at, self._listing_floor)
+    
+    @staticmethod
+    def _drop_entry(templates, signatures, filename, filepath):
+        templates.pop(filename, None)
+        signatures.pop(filepath, None)
+    
+    def template_id(self, filename):
+        """Stable ID of a template: pinned in the manifest or derived from the filename"""
+        template_id = self.manifest.get(filename)
+        if not template_id:
+            template_id = str(uuid.uuid5(TEMPLATE_ID_NAMESPACE, filename))
+        return template_id
+    
+    def _load_manifest(self):
+        """(Re)load the ID manifest if it changed on disk, returns True if reloaded"""
+        try:
+            st = os.stat(self.manifest_path)
+            signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+        except OSError:
+            signature = None
+        if signature == self._manifest_signature:
+            return False
+        
+        manifest = {}
+        if signature is not None:
+            try:
+                with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                    manifest = {str(k): str(v) for k, v in json.load(f).items()}
+            except Exception as e:
+                if self.logger:
+                    self.logger(f"Error reading template ID manifest: {str(e)}", "ERROR")
+        self._manifest_signature = signature
+        if manifest == self.manifest:
+            return False
+        self.manifest = manifest
+        return True
+    
+    def _save_manifest(self, templates, keep=None):
+        """Record IDs of newly seen templates in the manifest
+        
+        When keep (a set of filenames) is given, entries of other files are
+        removed from the manifest.
+        """
+        manifest = self.manifest
+        if keep is not None:
+            manifest = {filename: template_id for filename, template_id in manifest.items() if filename in keep}
+        new_ids = {filename: info['id'] for filename, info in templates.items()
+                   if manifest.get(filename) != info['id']}
+        if not new_ids and manifest == self.manifest:
+            return
+        manifest = dict(manifest, **new_ids)
+        tmp_path = self.manifest_path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=2, ensure_ascii=False, sort_keys=True)
+            os.replace(tmp_path, self.manifest_path)
+            st = os.stat(self.manifest_path)
+            self._manifest_signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+        except OSError as e:
+            if self.logger:
+                self.logger(f"Could not write template ID manifest: {str(e)}", "WARNING")
+        # Keep using the IDs even if the manifest could not be written
+        self.manifest = manifest
+    
+    def _load_template(self, filename, filepath):
+        """Read a template file once to parse it and compute its digests"""
+        with open(filepath, 'rb') as f:
+            st = os.fstat(f.fileno())
+            content = f.read()
+        template_data = json.loads(content.decode('utf-8'))
+        
+        signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+        md5_hash = self.checksums.get(filepath, signature, content)['md5']
+        
+        # Extract template info
+        template_name = template_data.get('Name', filename.replace('.json', ''))
+        template_id = self.template_id(filename)
+        
+        info = {
+            'name': template_name,
+            'id': template_id,
+            'filename': filename,
+            'filepath': filepath,
+            'md5': md5_hash,
+            'size': st.st_size,
+            'modified': datetime.fromtimestamp(st.st_mtime).isoformat()
+        }
+        return info, signature
+    
+    def add_template(self, source_file):
+        """Add a new template file"""
+        try:
+            filename = os.path.basename(source_file)
+            dest_path = os.path.join(self.resource_dir, filename)
+            
+            # Copy file to resource directory
+            with open(source_file, 'rb') as src, open(dest_path, 'wb') as dst:
+                dst.write(src.read())
+            
+            if self.cache:
+                self.cache.invalidate(dest_path)
+            
+            # Rescan templates
+            self.scan_templates()
+            
+            if self.logger:
+                self.logger(f"Template added: {filename}", "SUCCESS")
+            
+            return True
+        except Exception as e:
+            if self.logger:
+                self.logger(f"Failed to add template: {str(e)}", "ERROR")
+            return False
+    
+    def remove_template(self, filename):
+        """Remove a template file"""
+        try:
+            filepath = os.path.join(self.resource_dir, filename)
+            if os.path.exists(filepath):
+                os.remove(filepath)
+                if self.cache:
+                    self.cache.invalidate(filepath)
+                self.scan_templates()
+                
+                if self.logger:
+                    self.logger(f"Template removed: {filename}", "SUCCESS")
+                return True
+            return False
+        except Exception as e:
+            if self.logger:
+                self.logger(f"Failed to remove template: {str(e)}", "ERROR")
+            return False
+    
+    def find_template(self, name=None, template_id=None):
+        """Find template file by name or ID"""
+        info = self.index.find(name=name, template_id=template_id)
+        return info['filepath'] if info else None
+    
+    def find_template_info(self, name=None, template_id=None):
+        """Find template info (name, id, md5, filepath, ...) by name or ID"""
+        return self.index.find(name=name, template_id=template_id)
+    
+    def should_stream(self, template_info):
+        """Whether a template is sent straight from disk instead of from memory"""
+        return self.cache is None or template_info['size'] > TEMPLATE_STREAM_THRESHOLD
+    
+    def read_template(self, filepath):
+        """Read template file content, using the in-memory cache when possible
+        
+        A cache hit is validated against the signature recorded by the last
+        scan, so it is served without touching the filesystem.
+        """
+        return self.read_template_variants(filepath)['identity']
+    
+    def read_template_variants(self, filepath):
+        """Get the raw ('identity') and any precompressed variants of a template
+        
+        Compressed variants are built in the background the first time a file
+        version is cached, so early requests may only get 'identity'.
+        """
+        signature = self.signatures.get(filepath)
+        if self.cache and signature is not None:
+            cached = self.cache.get(filepath, signature)
+            if cached is not None:
+                variants, compressed = cached
+                if not compressed and self.compressor:
+                    self.compressor.schedule(filepath, signature, variants['identity'])
+                return variants
+        
+        with open(filepath, 'rb') as f:
+            st = os.fstat(f.fileno())
+            content = f.read()
+        
+        signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+        if self.signatures.get(filepath) not in (None, signature):
+            # Changed since the last scan: rescan it, so its MD5 (the ETag)
+            # matches this body and later lookups use this signature
+            self.scan_templates([os.path.basename(filepath)])
+        # Only cache under the signature lookups will use
+        if (self.cache and self.signatures.get(filepath) == signature
+                and self.cache.put(filepath, signature, content)):
+            self.compressor.schedule(filepath, signature, content)
+        # Share the bytes we already hold with the checksum registry
+        if self.checksums.peek(filepath, signature) is None:
+            self.checksums.get(filepath, signature, content)
+        return {'identity': content}
+    
+    def get_checksum(self, filepath, algorithm='md5'):
+        """Get a template digest ('md5' or 'crc32') without rehashing unchanged files"""
+        digests = self.checksums.get(filepath, self.signatures.get(filepath))
+        return digests.get(algorithm)
+    
+    def get_cache_stats(self):
+        """Get template cache hit/miss counters"""
+        if not self.cache:
+            return {'enabled': False}
+        stats = self.cache.stats()
+        stats['enabled'] = True
+        return stats
+    
+    def snapshot(self):
+        """The template table and list history as JSON-serialisable data
+        
+        Used to share one scan with other processes (see esl_prefork).
+        """
+        with self._scan_lock:
+            return {
+                'version': self.version,
+                'templates': self.templates,
+                'signatures': [[filepath, list(signature)] for filepath, signature in self.signatures.items()],
+                'changed_at': dict(self._changed_at),
+                'removed_at': list(self._removed_at.items()),
+                'floor': self._listing_floor,
+            }
+    
+    def get_template_list(self):
+        """Get list of all templates"""
+        return list(self.templates.values())
+    
+    def log_request(self, message):
+        """Log HTTP requests"""
+        if self.logger:
+            self.logger(message, "HTTP")
+
+class TemplateWatcher:
+    """Background watcher that reloads changed templates into a TemplateManager
+    
+    On Linux inotify reports which files changed and only those are rescanned;
+    elsewhere (or if inotify is unavailable) the directory is polled with the
+    incremental scan. Bursts of events are debounced into a single reload.
+    """
+    
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+                  IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+    EVENT_HEADER = struct.Struct('iIII')
+    
+    def __init__(self, template_manager, on_change=None, poll_interval=TEMPLATE_WATCH_POLL_INTERVAL,
+                 debounce=TEMPLATE_WATCH_DEBOUNCE, max_delay=TEMPLATE_WATCH_MAX_DELAY):
+        self.template_manager = template_manager
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.mode = None
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        """Start watching in a daemon thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="template-watcher", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """Stop watching"""
+        self._stop.set()
+    
+    def _log(self, message, level="INFO"):
+        if self.template_manager.logger:
+            self.template_manager.logger(message, level)
+    
+    def _run(self):
+        fd = self._open_inotify()
+        if fd is not None:
+            self.mode = 'inotify'
+            try:
+                self._watch_inotify(fd)
+            except Exception as e:
+                self._log(f"Template watcher error, falling back to polling: {str(e)}", "WARNING")
+            finally:
+                os.close(fd)
+        if not self._stop.is_set():
+            self.mode = 'poll'
+            self._watch_poll()
+    
+    def _open_inotify(self):
+        """Open an inotify watch on the resource directory, or None if unavailable"""
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                return None
+            path = os.fsencode(os.path.abspath(self.template_manager.resource_dir))
+            if libc.inotify_add_watch(fd, path, self.WATCH_MASK) < 0:
+                os.close(fd)
+                return None
+            return fd
+        except (OSError, AttributeError):
+            return None
+    
+    def _read_events(self, fd):
+        """Read pending inotify events as (mask, filename) pairs"""
+        try:
+            data = os.read(fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + self.EVENT_HEADER.size <= len(data):
+            _, mask, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((mask, os.fsdecode(name)))
+        return events
+    
+    def _watch_inotify(self, fd):
+        pending = set()
+        rescan_all = False
+        first_event = last_event = None
+        
+        while not self._stop.is_set():
+            waiting = pending or rescan_all
+            ready, _, _ = select.select([fd], [], [], self.debounce if waiting else 1.0)
+            now = time.monotonic()
+            
+            if ready:
+                for mask, name in self._read_events(fd):
+                    if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF | self.IN_IGNORED):
+                        # The directory itself went away; polling copes with that
+                        return
+                    if mask & self.IN_Q_OVERFLOW:
+                        rescan_all = True
+                    elif name:
+                        pending.add(name)
+                if first_event is None:
+                    first_event = now
+                last_event = now
+            
+            if not (pending or rescan_all):
+                continue
+            if now - last_event < self.debounce and now - first_event < self.max_delay:
+                continue
+            
+            self._reload(None if rescan_all else pending)
+            pending = set()
+            rescan_all = False
+            first_event = last_event = None
+    
+    def _watch_poll(self):
+        while not self._stop.wait(self.poll_interval):
+            self._reload(None)
+    
+    def _reload(self, filenames):
+        """Apply changed files to the template manager"""
+        try:
+            changes = self.template_manager.scan_templates(filenames)
+        except Exception as e:
+            self._log(f"Template reload failed: {str(e)}", "ERROR")
+            return
+        if changes['added'] or changes['changed'] or changes['removed']:
+            self._log(f"Templates reloaded: {len(changes['added'])} added, "
+                      f"{len(changes['changed'])} changed, {len(changes['removed'])} removed", "INFO")
+            if self.on_change:
+                self.on_change(changes)
+
+# Cheap way to find the shop of a raw MQTT payload without parsing the JSON
+_SHOP_FIELD = re.compile(rb'"shop"\s*:\s*(?:"([^"]*)"|(-?\d+))')
+_COMMAND_FIELD = re.compile(rb'"command"\s*:\s*"([^"]*)"')
+
+def message_shop(payload):
+    """Shop ID (string or number) of a raw MQTT payload, or None if it has none"""
+    match = _SHOP_FIELD.search(payload)
+    if not match:
+        return None
+    return match.group(1) if match.group(1) is not None else match.group(2)
+
+class MessageDispatcher:
+    """Bounded worker pool for MQTT messages with per-key ordering
+    
+    Each key (the shop ID) is always handled by the same worker, so messages
+    of one shop are processed in arrival order while different shops are
+    processed in parallel. submit blocks for at most enqueue_timeout when the
+    worker queue is full and drops the message after that.
+    """
+    
+    def __init__(self, handler, workers=MQTT_WORKERS, queue_size=MQTT_QUEUE_SIZE,
+                 enqueue_timeout=MQTT_ENQUEUE_TIMEOUT, logger=None):
+        self.handler = handler
+        self.enqueue_timeout = enqueue_timeout
+        self.logger = logger
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.max_wait = 0.0
+        self.max_handling = 0.0
+        self._stopping = False
+        # Recent (queue wait, handling time) samples for percentiles
+        self._samples = deque(maxlen=1000)
+        self._lock = threading.Lock()
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(max(1, workers))]
+        self._threads = []
+        for i, work_queue in enumerate(self._queues):
+            thread = threading.Thread(target=self._run, args=(work_queue,), name=f"mqtt-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+    
+    def submit(self, key, *args):
+        """Queue handler(*args) on the worker for key, returns False if dropped"""
+        if self._stopping:
+            return False
+        work_queue = self._queues[zlib.crc32(key or b'') % len(self._queues)]
+        try:
+            work_queue.put((time.monotonic(), args), timeout=self.enqueue_timeout)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            if self.logger:
+                self.logger("MQTT worker queue full, message dropped", "WARNING")
+            return False
+    
+    def _run(self, work_queue):
+        while True:
+            item = work_queue.get()
+            if item is None:
+                break
+            queued_at, args = item
+            started = time.monotonic()
+            try:
+                self.handler(*args)
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                if self.logger:
+                    self.logger(f"Error handling MQTT message: {str(e)}", "ERROR")
+            finished = time.monotonic()
+            
+            wait, handling = started - queued_at, finished - started
+            with self._lock:
+                self.processed += 1
+                self.max_wait = max(self.max_wait, wait)
+                self.max_handling = max(self.max_handling, handling)
+                self._samples.append((wait, handling))
+    
+    def queue_depth(self):
+        """Messages waiting in all worker queues"""
+        return sum(work_queue.qsize() for work_queue in self._queues)
+    
+    def stats(self):
+        """Queue depth and latency figures (milliseconds) of recent messages"""
+        with self._lock:
+            samples = list(self._samples)
+            stats = {
+                'workers': len(self._queues),
+                'queue_depth': self.queue_depth(),
+                'queue_depth_per_worker': [work_queue.qsize() for work_queue in self._queues],
+                'processed': self.processed,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'max_wait_ms': round(self.max_wait * 1000, 3),
+                'max_handling_ms': round(self.max_handling * 1000, 3),
+            }
+        for index, name in ((0, 'wait'), (1, 'handling')):
+            values = sorted(sample[index] for sample in samples)
+            if values:
+                stats[f'{name}_p50_ms'] = round(values[len(values) // 2] * 1000, 3)
+                stats[f'{name}_p95_ms'] = round(values[min(len(values) - 1, int(len(values) * 0.95))] * 1000, 3)
+        return stats
+    
+    def stop(self, timeout=MQTT_STOP_TIMEOUT):
+        """Stop the workers after the messages already queued
+        
+        New messages are refused from now on. A queue still full after
+        timeout seconds is emptied (its messages count as dropped), so
+        stopping never hangs on a busy worker.
+        """
+        self._stopping = True
+        deadline = time.monotonic() + timeout
+        for work_queue in self._queues:
+            try:
+                work_queue.put(None, timeout=max(0.0, deadline - time.monotonic()))
+                continue
+            except queue.Full:
+                pass
+            dropped = 0
+            while True:
+                try:
+                    work_queue.get_nowait()
+                    dropped += 1
+                except queue.Empty:
+                    break
+            with self._lock:
+                self.dropped += dropped
+            if self.logger:
+                self.logger(f"Stopping MQTT worker, {dropped} queued messages dropped", "WARNING")
+            work_queue.put_nowait(None)
+
+class ResponseCache:
+    """Short-lived cache of tmpllist answers
+    
+    Entries are keyed by the caller (shop, requested template list and
+    template table version) and expire after ttl seconds. A change of the
+    template table gives new keys, so stale answers are never reused and
+    simply age out of the LRU.
+    """
+    
+    def __init__(self, ttl=TMPLLIST_CACHE_TTL, max_entries=TMPLLIST_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        """Cached value for key, or None if missing or expired"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+    
+    def put(self, key, value):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+def shared_topic(topic, group):
+    """Topic filter for a shared subscription of group, or topic unchanged"""
+    if not group or topic.startswith('$share/'):
+        return topic
+    return f"$share/{group}/{topic}"
+
+def shop_topic(template, shop):
+    """Fill {shop} in a topic template, None if shop is not usable in a topic"""
+    if '{shop}' not in template:
+        return template
+    shop = str(shop)
+    if not shop or any(c in shop for c in '/+#\0'):
+        return None
+    return template.replace('{shop}', shop)
+
+class ShopTracker:
+    """Shops that sent requests to this instance"""
+    
+    def __init__(self, active_window=SHOP_ACTIVE_WINDOW):
+        self.active_window = active_window
+        # shop -> (last request time, request count)
+        self._shops = {}
+        self._lock = threading.Lock()
+    
+    def seen(self, shop):
+        with self._lock:
+            count = self._shops.get(shop, (0, 0))[1]
+            self._shops[shop] = (time.monotonic(), count + 1)
+    
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            shops = dict(self._shops)
+        active = [shop for shop, (last, count) in shops.items() if now - last <= self.active_window]
+        return {
+            'instance': f"{socket.gethostname()}:{os.getpid()}",
+            'active_shops': len(active),
+            'known_shops': len(shops),
+            'requests': sum(count for last, count in shops.values()),
+        }
+
+def load_config(path=None, environ=None):
+    """Build the server settings from DEFAULT_CONFIG, a JSON file and the environment"""
+    config = dict(DEFAULT_CONFIG)
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            overrides = json.load(f)
+        unknown = sorted(set(overrides) - set(DEFAULT_CONFIG))
+        if unknown:
+            raise ValueError(f"Unknown config keys in {path}: {', '.join(unknown)}")
+        config.update(overrides)
+    
+    environ = os.environ if environ is None else environ
+    for key, default in DEFAULT_CONFIG.items():
+        value = environ.get('ESL_' + key.upper())
+        if value is None:
+            continue
+        if isinstance(default, bool):
+            value = value.strip().lower() in ('1', 'true', 'yes', 'on')
+        elif isinstance(default, int):
+            value = int(value)
+        elif isinstance(default, list):
+            value = [item.strip() for item in value.split(',') if item.strip()]
+        config[key] = value
+    return config
+
+def register_template_metrics(manager):
+    """Expose the template table and content cache of manager in /api/metrics"""
+    METRICS.callback('esl_template_cache_hit_ratio', "Template content cache hit ratio",
+                     lambda: manager.get_cache_stats().get('hit_ratio', 0.0))
+    METRICS.callback('esl_template_cache_bytes', "Bytes held by the template content cache",
+                     lambda: manager.get_cache_stats().get('bytes', 0))
+    METRICS.callback('esl_templates', "Templates in the resource directory", lambda: len(manager.templates))
+
+def console_log(msg, level='INFO'):
+    """Log to stdout, used when there is no GUI"""
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {level}: {msg}", flush=True)
+
+class TemplateServer:
+    """Template server core: templates, HTTP server and MQTT template requests
+    
+    Runs on its own in headless mode; the Tk GUI is a front-end over it.
+    """
+    
+    def __init__(self, config=None, logger=None):
+        self.config = dict(DEFAULT_CONFIG, **(config or {}))
+        self.logger = logger or console_log
+        self.client = None
+        self.is_connected = False
+        self.http_server = None
+        self.http_thread = None
+        self.template_watcher = None
+        # Topics to (re)subscribe to whenever the connection is established
+        self.subscriptions = list(self.config['subscribe_topics'])
+        self.response_topic = self.config['response_topic']
+        # Called with True/False when the broker connection changes
+        self.on_connection_change = None
+        
+        self.template_manager = TemplateManager(self.config['resource_dir'], self.log)
+        
+        # Template requests are handled off paho's network thread
+        self.dispatcher = MessageDispatcher(
+            self.process_message,
+            workers=self.config['mqtt_workers'],
+            queue_size=self.config['mqtt_queue_size'],
+            logger=self.log,
+        )
+        # Answers to duplicate tmpllist requests
+        self.response_cache = ResponseCache()
+        self.shops = ShopTracker()
+    
+    def log(self, msg, level='INFO'):
+        self.logger(msg, level)
+    
+    def start_http_server(self):
+        """Start HTTP server for template serving, returns False if it could not start"""
+        try:
+            def handler(*args, **kwargs):
+                return TemplateHTTPHandler(*args, template_manager=self.template_manager, **kwargs)
+            
+            port = self.config['http_port']
+            # Bind to all interfaces (0.0.0.0) to allow access from any IP
+            self.attach_http_server(create_http_server(
+                (self.config['http_host'], port), handler,
+                mode=self.config['http_mode'],
+                max_connections=self.config['http_max_connections'],
+                queue_depth=self.config['http_queue_depth'],
+            ))
+            self.http_thread = threading.Thread(target=self.http_server.serve_forever, daemon=True)
+            self.http_thread.start()
+            
+            # Get local IP for display
+            hostname = socket.gethostname()
+            try:
+                local_ip = socket.gethostbyname(hostname)
+            except OSError:
+                local_ip = hostname
+            
+            self.log("HTTP Server started successfully!", "SUCCESS")
+            self.log(f"Concurrency mode: {describe_http_server(self.http_server)}", "INFO")
+            self.log(f"Local access: http://localhost:{port}", "INFO")
+            self.log(f"Network access: http://{local_ip}:{port}", "INFO")
+            self.log("Available endpoints:", "INFO")
+            self.log("  POST /api/res/templ/loadtemple - Load template", "INFO")
+            self.log("  GET /api/res/templ/list - List templates", "INFO")
+            self.log("  GET /api/health - Health check", "INFO")
+            self.log("  GET /api/metrics - Metrics", "INFO")
+            return True
+            
+        except Exception as e:
+            self.log(f"Failed to start HTTP server: {str(e)}", "ERROR")
+            return False
+    
+    def attach_http_server(self, http_server):
+        """Use http_server as this server's template HTTP server (health and metrics)"""
+        self.http_server = http_server
+        self.http_server.health_providers = {
+            'mqtt_workers': self.dispatcher.stats,
+            'tmpllist_cache': self.response_cache.stats,
+            'shops': self.shops.stats,
+        }
+        self.register_metrics()
+    
+    def register_metrics(self):
+        """Expose queue, cache and connection state of this server in /api/metrics"""
+        register_template_metrics(self.template_manager)
+        METRICS.callback('esl_tmpllist_cache_hit_ratio', "tmpllist response cache hit ratio",
+                         lambda: self.response_cache.stats()['hit_rate'])
+        METRICS.callback('esl_mqtt_queue_depth', "MQTT messages waiting for a worker", self.dispatcher.queue_depth)
+        METRICS.callback('esl_mqtt_messages_dropped_total', "MQTT messages dropped because the worker queue was full",
+                         lambda: self.dispatcher.dropped, kind='counter')
+        METRICS.callback('esl_mqtt_connected', "1 while connected to the broker", lambda: int(self.is_connected))
+        server = self.http_server
+        METRICS.callback('esl_http_rejected_connections_total', "Connections rejected with 503 because the queue was full",
+                         lambda: getattr(server, 'rejected_connections', 0), kind='counter')
+        METRICS.callback('esl_http_queued_connections', "Connections waiting for an HTTP worker",
+                         lambda: server.queued_connections() if hasattr(server, 'queued_connections') else 0)
+        METRICS.callback('esl_http_idle_connections', "Idle persistent connections parked without a worker",
+                         lambda: server.idle_connections() if hasattr(server, 'idle_connections') else 0)
+    
+    def start_watcher(self, on_change=None):
+        """Reload templates automatically when files change"""
+        self.template_watcher = TemplateWatcher(self.template_manager, on_change=on_change)
+        self.template_watcher.start()
+    
+    def connect(self, host=None, port=None, username=None, password=None):
+        """Connect to the MQTT broker and start the network loop
+        
+        Raises if the broker cannot be reached; once connected, paho
+        reconnects on its own and subscriptions are renewed in on_connect.
+        """
+        host = host or self.config['mqtt_host']
+        port = int(port or self.config['mqtt_port'])
+        if username is None:
+            username, password = self.config['mqtt_username'], self.config['mqtt_password']
+        
+        self.log("Attempting to connect to MQTT broker...")
+        
+        # Create client with clean session for faster connection
+        self.client = mqtt.Client(clean_session=True)
+        
+        # Set connection timeout for faster failure detection
+        self.client.connect_timeout = 5
+        
+        if username:
+            self.client.username_pw_set(username, password)
+        
+        # Set up callbacks
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self.client.on_disconnect = self.on_disconnect
+        
+        # Connect to broker
+        self.client.connect(host, port, self.config['mqtt_keepalive'])
+        self.start_network_loop()
+    
+    def start_network_loop(self):
+        """Run paho's network loop on its own thread"""
+        self.client.loop_start()
+    
+    def disconnect(self):
+        """Disconnect from MQTT broker"""
+        if self.client and self.is_connected:
+            self.client.loop_stop()
+            self.client.disconnect()
+            self.log("Disconnected from broker")
+    
+    def _set_connected(self, connected):
+        self.is_connected = connected
+        if self.on_connection_change:
+            self.on_connection_change(connected)
+    
+    def on_connect(self, client, userdata, flags, rc):
+        """Callback for successful connection"""
+        if rc == 0:
+            self.log("Successfully connected to MQTT broker", "SUCCESS")
+            self._set_connected(True)
+            for topic in self.subscriptions:
+                topic = shared_topic(topic, self.config['mqtt_share_group'])
+                client.subscribe(topic)
+                self.log(f"Subscribed to topic: {topic}", "SUCCESS")
+        else:
+            error_msg = f"Connection failed with code {rc}"
+            self.log(error_msg, "ERROR")
+            self._set_connected(False)
+    
+    def on_disconnect(self, client, userdata, rc):
+        """Callback for disconnection"""
+        self.log("Disconnected from broker", "INFO")
+        self._set_connected(False)
+    
+    def subscribe(self, topic):
+        """Subscribe to a topic now and after every reconnect"""
+        topic_filter = shared_topic(topic, self.config['mqtt_share_group'])
+        self.client.subscribe(topic_filter)
+        if topic not in self.subscriptions:
+            self.subscriptions.append(topic)
+        self.log(f"Subscribed to topic: {topic_filter}", "SUCCESS")
+    
+    def publish(self, topic, payload):
+        """Publish a message to a topic"""
+        self.client.publish(topic, payload)
+        match = _COMMAND_FIELD.search(payload.encode('utf-8') if isinstance(payload, str) else payload)
+        METRICS.inc('esl_mqtt_messages_published_total', command_labels(match.group(1).decode('utf-8') if match else None))
+    
+    def on_message(self, client, userdata, msg):
+        """Callback for received messages, runs on paho's network thread
+        
+        Only the shop ID is extracted here; parsing and template lookups run
+        on the dispatcher's workers so keepalives and inbound traffic are
+        never held up by request handling.
+        """
+        self.dispatcher.submit(message_shop(msg.payload) or msg.topic.encode('utf-8'), msg.topic, msg.payload)
+    
+    def process_message(self, topic, payload):
+        """Handle a received message with template request handling (worker thread)"""
+        try:
+            payload = payload.decode('utf-8')
+            self.log(f"Received from [{topic}]: {payload}", "RECEIVED")
+            
+            # Try to parse as JSON for template requests
+            try:
+                message_data = json_loads(payload)
+                command = message_data.get('command') if isinstance(message_data, dict) else None
+                METRICS.inc('esl_mqtt_messages_received_total', command_labels(command))
+                
+                # Check if this is a template list request
+                if command == 'tmpllist':
+                    self.handle_template_request(message_data)
+                    
+            except json.JSONDecodeError:
+                # Not JSON, just log as regular message
+                METRICS.inc('esl_mqtt_messages_received_total', command_labels(None))
+                
+        except UnicodeDecodeError:
+            METRICS.inc('esl_mqtt_messages_received_total', command_labels(None))
+            self.log(f"Received binary data from [{topic}]", "RECEIVED")
+    
+    def handle_template_request(self, request_data):
+        """Handle template list requests from MQTT"""
+        started = time.perf_counter()
+        try:
+            shop = request_data.get('shop', '')
+            data = request_data.get('data', {})
+            templates_requested = data.get('tmpls', [])
+            url = data.get('url', '')
+            tid = data.get('tid', '')
+            
+            self.log(f"Template request from shop {shop} for {len(templates_requested)} templates", "INFO")
+            if shop:
+                self.shops.seen(str(shop))
+            
+            # Duplicate requests of a shop are answered from the cache while
+            # the template table is unchanged. The key is the requested list
+            # as sent (order and value types), since the reply echoes it.
+            key = (shop, self.template_manager.version, json_dumps(templates_requested))
+            available_templates = self.response_cache.get(key)
+            if available_templates is None:
+                # Prepare response with available templates
+                available_templates = []
+                for template_req in templates_requested:
+                    template_name = template_req.get('name', '')
+                    template_id = template_req.get('id', '')
+                    
+                    # Find matching template
+                    template_file = self.template_manager.find_template(template_name, template_id)
+                    if template_file:
+                        # MD5 is computed once per file version by the registry
+                        md5_hash = self.template_manager.get_checksum(template_file)
+                        
+                        available_templates.append({
+                            'name': template_name,
+                            'id': template_id,
+                            'md5': md5_hash,
+                            'status': 'available'
+                        })
+                    else:
+                        available_templates.append({
+                            'name': template_name,
+                            'id': template_id,
+                            'status': 'not_found'
+                        })
+                
+                self.response_cache.put(key, available_templates)
+            
+            # Send response; only tid, id and timestamp differ between duplicates
+            response = {
+                'shop': shop,
+                'data': {
+                    'tmpls': available_templates,
+                    'url': self.config['template_url'],
+                    'tid': tid
+                },
+                'id': str(uuid.uuid4()),
+                'command': 'tmpllist_response',
+                'timestamp': time.time()
+            }
+            
+            # Publish response
+            response_topic = shop_topic(self.response_topic or 'template/response', shop)
+            if response_topic is None:
+                response_topic = self.config['response_topic_default'] or 'template/response'
+                self.log(f"Shop ID {shop!r} cannot be used in a topic, responding on {response_topic}", "WARNING")
+            self.client.publish(response_topic, json_dumps(response))
+            METRICS.inc('esl_mqtt_messages_published_total', command_labels('tmpllist'))
+            METRICS.observe('esl_mqtt_tmpllist_duration_seconds', time.perf_counter() - started)
+            self.log(f"Template list response sent to {response_topic}", "SENT")
+            
+        except Exception as e:
+            self.log(f"Error handling template request: {str(e)}", "ERROR")
+    
+    def shutdown(self):
+        """Stop the watcher, the HTTP server and the MQTT connection"""
+        if self.template_watcher:
+            self.template_watcher.stop()
+        self.dispatcher.stop()
+        if self.http_server:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.http_server = None
+        if self.client:
+            self.client.loop_stop()
+            self.client.disconnect()
+
+def run_headless(config):
+    """Run the template server without GUI until SIGINT/SIGTERM, returns an exit code"""
+    if config.get('http_mode') == 'asyncio':
+        from esl_async import run_async
+        return run_async(config)
+    if config.get('http_processes', 1) > 1:
+        from esl_prefork import run_prefork
+        return run_prefork(config)
+    
+    server = TemplateServer(config)
+    if not server.start_http_server():
+        return 1
+    if server.config['template_watch']:
+        server.start_watcher()
+    
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stop.set())
+    
+    # Keep trying until the broker is reachable; after that paho reconnects by itself
+    delay = 1
+    while not stop.is_set():
+        try:
+            server.connect()
+            break
+        except Exception as e:
+            server.log(f"Connection failed: {str(e)}, retrying in {delay}s", "ERROR")
+            stop.wait(delay)
+            delay = min(delay * 2, 60)
+    
+    # Wake up regularly so signals are handled promptly on every platform
+    while not stop.wait(1):
+        pass
+    
+    server.log("Shutting down", "INFO")
+    server.shutdown()
+    return 0
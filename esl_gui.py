@@ -0,0 +1,472 @@
+import tkinter as tk
+from tkinter import ttk, scrolledtext, messagebox, filedialog
+import threading
+import queue
+import time
+
+from esl_core import TemplateServer, json_loads, shop_topic
+
+# Activity log: lines kept in the widget, how often (ms) queued lines are
+# written to it, the most lines written per update, and how many lines may
+# wait in the queue before new ones are dropped
+LOG_MAX_LINES = 2000
+LOG_FLUSH_INTERVAL_MS = 100
+LOG_BATCH_MAX = 500
+LOG_QUEUE_MAX = 10000
+
+
+class MQTTApp:
+    # Activity log text tag for each message level
+    LOG_TAGS = {
+        'SENT': 'sent',
+        'RECEIVED': 'received',
+        'SUCCESS': 'success',
+        'ERROR': 'error',
+        'WARNING': 'warning',
+        'INFO': 'info',
+        'HTTP': 'http'
+    }
+    
+    def __init__(self, root, config=None):
+        self.root = root
+        self.is_connected = False
+        
+        # Log lines from any thread are queued here and written to the widget
+        # by the Tk main loop (see flush_log)
+        self.log_queue = queue.Queue(maxsize=LOG_QUEUE_MAX)
+        self.log_dropped = 0
+        
+        # Initialize the server core (template manager, HTTP server, MQTT) first
+        self.server = TemplateServer(config, logger=self.log_msg)
+        self.server.on_connection_change = lambda connected: self.root.after(
+            0, lambda: self.update_connection_status(connected))
+        # Topics are subscribed from the UI
+        self.server.subscriptions = []
+        self.template_manager = self.server.template_manager
+        
+        # Setup UI after template manager is ready
+        self.setup_ui()
+        
+        # Start HTTP server
+        self.server.start_http_server()
+        
+        # Reload templates automatically when files change
+        if self.server.config['template_watch']:
+            self.server.start_watcher(
+                on_change=lambda changes: self.root.after(0, self.update_template_tree)
+            )
+        
+    def setup_ui(self):
+        """Initialize and configure the user interface"""
+        self.root.title("MQTT Template Server")
+        self.root.geometry("1200x800")
+        self.root.configure(bg='#f0f0f0')
+        
+        # Configure styles
+        style = ttk.Style()
+        style.theme_use('clam')
+        
+        # Configure custom styles
+        style.configure('Title.TLabel', font=('Arial', 12, 'bold'), background='#f0f0f0')
+        style.configure('Connect.TButton', font=('Arial', 10, 'bold'))
+        style.configure('Action.TButton', font=('Arial', 9))
+        
+        # Main container with padding
+        main_frame = ttk.Frame(self.root, padding="10")
+        main_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        
+        # Configure grid weights for responsive design
+        self.root.columnconfigure(0, weight=1)
+        self.root.rowconfigure(0, weight=1)
+        main_frame.columnconfigure(0, weight=2)
+        main_frame.columnconfigure(1, weight=1)
+        main_frame.rowconfigure(3, weight=1)
+        
+        # Left side - MQTT functionality
+        left_frame = ttk.Frame(main_frame)
+        left_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), padx=(0, 10))
+        left_frame.columnconfigure(1, weight=1)
+        left_frame.rowconfigure(3, weight=1)
+        
+        # Connection Section
+        conn_frame = ttk.LabelFrame(left_frame, text="MQTT Connection Settings", padding="15")
+        conn_frame.grid(row=0, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 15))
+        conn_frame.columnconfigure(1, weight=1)
+        
+        ttk.Label(conn_frame, text="Broker IP:", style='Title.TLabel').grid(row=0, column=0, sticky='w', padx=(0, 10))
+        self.ip = ttk.Entry(conn_frame, font=('Arial', 10), width=20)
+        self.ip.insert(0, self.server.config['mqtt_host'])
+        self.ip.grid(row=0, column=1, sticky=(tk.W, tk.E), padx=(0, 20))
+
+        ttk.Label(conn_frame, text="Port:", style='Title.TLabel').grid(row=0, column=2, sticky='w', padx=(0, 10))
+        self.port = ttk.Entry(conn_frame, font=('Arial', 10), width=10)
+        self.port.insert(0, str(self.server.config['mqtt_port']))
+        self.port.grid(row=0, column=3, sticky='w')
+
+        ttk.Label(conn_frame, text="Username:", style='Title.TLabel').grid(row=1, column=0, sticky='w', padx=(0, 10), pady=(10, 0))
+        self.username = ttk.Entry(conn_frame, font=('Arial', 10))
+        self.username.grid(row=1, column=1, sticky=(tk.W, tk.E), padx=(0, 20), pady=(10, 0))
+
+        ttk.Label(conn_frame, text="Password:", style='Title.TLabel').grid(row=1, column=2, sticky='w', padx=(0, 10), pady=(10, 0))
+        self.password = ttk.Entry(conn_frame, show="*", font=('Arial', 10))
+        self.password.grid(row=1, column=3, sticky='w', pady=(10, 0))
+
+        # Connection button with status indicator
+        button_frame = ttk.Frame(conn_frame)
+        button_frame.grid(row=2, column=0, columnspan=4, pady=(15, 0))
+        
+        self.connect_btn = ttk.Button(button_frame, text="Connect", command=self.connect, style='Connect.TButton')
+        self.connect_btn.pack(side=tk.LEFT, padx=(0, 10))
+        
+        self.status_label = ttk.Label(button_frame, text="Disconnected", foreground='red')
+        self.status_label.pack(side=tk.LEFT)
+
+        # Subscribe Section
+        sub_frame = ttk.LabelFrame(left_frame, text="Subscribe to Topic", padding="15")
+        sub_frame.grid(row=1, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 15))
+        sub_frame.columnconfigure(0, weight=1)
+
+        topic_sub_frame = ttk.Frame(sub_frame)
+        topic_sub_frame.grid(row=0, column=0, sticky=(tk.W, tk.E))
+        topic_sub_frame.columnconfigure(0, weight=1)
+
+        ttk.Label(topic_sub_frame, text="Topic:", style='Title.TLabel').grid(row=0, column=0, sticky='w', padx=(0, 10))
+        self.topic_sub = ttk.Entry(topic_sub_frame, font=('Arial', 10))
+        self.topic_sub.insert(0, ','.join(self.server.config['subscribe_topics']))
+        self.topic_sub.grid(row=0, column=1, sticky=(tk.W, tk.E), padx=(0, 10))
+        self.topic_sub.bind('<Return>', lambda e: self.subscribe())
+        
+        ttk.Button(topic_sub_frame, text="Subscribe", command=self.subscribe, style='Action.TButton').grid(row=0, column=2)
+
+        # Publish Section
+        pub_frame = ttk.LabelFrame(left_frame, text="Publish Message", padding="15")
+        pub_frame.grid(row=2, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 15))
+        pub_frame.columnconfigure(0, weight=1)
+
+        ttk.Label(pub_frame, text="Topic:", style='Title.TLabel').grid(row=0, column=0, sticky='w', pady=(0, 5))
+        # Template responses go to the topic shown here
+        self.topic_pub_var = tk.StringVar(value=self.server.config['response_topic'])
+        self.topic_pub_var.trace_add('write', lambda *args: setattr(
+            self.server, 'response_topic', self.topic_pub_var.get().strip()))
+        self.topic_pub = ttk.Entry(pub_frame, font=('Arial', 10), textvariable=self.topic_pub_var)
+        self.topic_pub.grid(row=0, column=1, sticky=(tk.W, tk.E), pady=(0, 10))
+
+        ttk.Label(pub_frame, text="Message (JSON):", style='Title.TLabel').grid(row=1, column=0, sticky='nw', pady=(0, 5))
+        
+        # Message text area with better styling
+        msg_frame = ttk.Frame(pub_frame)
+        msg_frame.grid(row=1, column=1, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 10))
+        msg_frame.columnconfigure(0, weight=1)
+        
+        self.message = scrolledtext.ScrolledText(msg_frame, width=40, height=4, font=('Consolas', 10), 
+                                               wrap=tk.WORD, relief='solid', borderwidth=1)
+        self.message.grid(row=0, column=0, sticky=(tk.W, tk.E))
+
+        publish_frame = ttk.Frame(pub_frame)
+        publish_frame.grid(row=2, column=1, sticky='w')
+        ttk.Button(publish_frame, text="Publish", command=self.publish, style='Action.TButton').pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Button(publish_frame, text="Clear", command=self.clear_message, style='Action.TButton').pack(side=tk.LEFT)
+
+        # Log Section
+        log_frame = ttk.LabelFrame(left_frame, text="Activity Log", padding="15")
+        log_frame.grid(row=3, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 0))
+        log_frame.columnconfigure(0, weight=1)
+        log_frame.rowconfigure(0, weight=1)
+
+        self.log = scrolledtext.ScrolledText(log_frame, width=60, height=10, state='disabled', 
+                                           font=('Consolas', 9), wrap=tk.WORD, relief='solid', borderwidth=1)
+        self.log.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        
+        # Configure text tags for different message alignments and colors
+        self.log.tag_configure("sent", justify='right', foreground='#0066cc', background='#e6f3ff')
+        self.log.tag_configure("received", justify='left', foreground='#009900', background='#f0fff0')
+        self.log.tag_configure("info", justify='center', foreground='#666666')
+        self.log.tag_configure("error", justify='center', foreground='#cc0000', background='#ffe6e6')
+        self.log.tag_configure("success", justify='center', foreground='#009900', background='#f0fff0')
+        self.log.tag_configure("warning", justify='center', foreground='#ff6600', background='#fff3e6')
+        self.log.tag_configure("http", justify='center', foreground='#9900cc', background='#f9f0ff')
+        
+        # Add clear log button and dropped line counter
+        log_btn_frame = ttk.Frame(log_frame)
+        log_btn_frame.grid(row=1, column=0, sticky=(tk.W, tk.E), pady=(10, 0))
+        ttk.Button(log_btn_frame, text="Clear Log", command=self.clear_log, style='Action.TButton').pack(side=tk.LEFT)
+        self.log_status = ttk.Label(log_btn_frame, text="", foreground='#ff6600')
+        self.log_status.pack(side=tk.LEFT, padx=(10, 0))
+        self.shown_dropped = 0
+        
+        # Start writing queued log lines
+        self.root.after(LOG_FLUSH_INTERVAL_MS, self.flush_log)
+
+        # Right side - Template Management
+        right_frame = ttk.LabelFrame(main_frame, text="Template File Manager", padding="15")
+        right_frame.grid(row=0, column=1, rowspan=4, sticky=(tk.W, tk.E, tk.N, tk.S))
+        right_frame.columnconfigure(0, weight=1)
+        right_frame.rowconfigure(1, weight=1)
+        
+        # Template management buttons
+        template_btn_frame = ttk.Frame(right_frame)
+        template_btn_frame.grid(row=0, column=0, sticky=(tk.W, tk.E), pady=(0, 10))
+        
+        ttk.Button(template_btn_frame, text="Add Template", command=self.add_template, style='Action.TButton').pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(template_btn_frame, text="Remove Selected", command=self.remove_template, style='Action.TButton').pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(template_btn_frame, text="Refresh", command=self.refresh_templates, style='Action.TButton').pack(side=tk.LEFT)
+        
+        # Template list
+        list_frame = ttk.Frame(right_frame)
+        list_frame.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        list_frame.columnconfigure(0, weight=1)
+        list_frame.rowconfigure(0, weight=1)
+        
+        # Create treeview for template list
+        columns = ('Name', 'Size', 'Modified')
+        self.template_tree = ttk.Treeview(list_frame, columns=columns, show='tree headings', height=15)
+        
+        # Configure columns
+        self.template_tree.heading('#0', text='Filename')
+        self.template_tree.heading('Name', text='Template Name')
+        self.template_tree.heading('Size', text='Size')
+        self.template_tree.heading('Modified', text='Modified')
+        
+        self.template_tree.column('#0', width=150)
+        self.template_tree.column('Name', width=120)
+        self.template_tree.column('Size', width=80)
+        self.template_tree.column('Modified', width=120)
+        
+        # Add scrollbar
+        tree_scroll = ttk.Scrollbar(list_frame, orient='vertical', command=self.template_tree.yview)
+        self.template_tree.configure(yscrollcommand=tree_scroll.set)
+        
+        self.template_tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        tree_scroll.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        
+        # Server info
+        server_info_frame = ttk.LabelFrame(right_frame, text="HTTP Server Info", padding="10")
+        server_info_frame.grid(row=2, column=0, sticky=(tk.W, tk.E), pady=(10, 0))
+        
+        self.server_info = ttk.Label(server_info_frame, text="Server: http://10.3.36.36:8080", font=('Arial', 10, 'bold'))
+        self.server_info.pack()
+        
+        ttk.Label(server_info_frame, text="Endpoints:", font=('Arial', 9, 'bold')).pack(anchor='w')
+        ttk.Label(server_info_frame, text="POST /api/res/templ/loadtemple", font=('Consolas', 8)).pack(anchor='w')
+        ttk.Label(server_info_frame, text="GET /api/res/templ/list", font=('Consolas', 8)).pack(anchor='w')
+        
+        # Load initial templates
+        self.refresh_templates()
+
+    def add_template(self):
+        """Add a new template file"""
+        file_path = filedialog.askopenfilename(
+            title="Select Template File",
+            filetypes=[("JSON files", "*.json"), ("All files", "*.*")]
+        )
+        
+        if file_path:
+            if self.template_manager.add_template(file_path):
+                self.refresh_templates()
+            else:
+                messagebox.showerror("Error", "Failed to add template file")
+
+    def remove_template(self):
+        """Remove selected template"""
+        selection = self.template_tree.selection()
+        if not selection:
+            messagebox.showwarning("Warning", "Please select a template to remove")
+            return
+        
+        item = selection[0]
+        filename = self.template_tree.item(item)['text']
+        
+        if messagebox.askyesno("Confirm", f"Remove template '{filename}'?"):
+            if self.template_manager.remove_template(filename):
+                self.refresh_templates()
+            else:
+                messagebox.showerror("Error", "Failed to remove template file")
+
+    def refresh_templates(self):
+        """Refresh template list display"""
+        # Rescan templates
+        self.template_manager.scan_templates()
+        self.update_template_tree()
+    
+    def update_template_tree(self):
+        """Show the current template table in the tree view"""
+        # Clear existing items
+        for item in self.template_tree.get_children():
+            self.template_tree.delete(item)
+        
+        # Add templates to tree
+        for filename, info in self.template_manager.templates.items():
+            size_str = f"{info['size']} bytes"
+            modified_str = info['modified'][:19].replace('T', ' ')
+            
+            self.template_tree.insert('', 'end', text=filename, values=(
+                info['name'], size_str, modified_str
+            ))
+
+    def log_msg(self, msg, level='INFO'):
+        """Add message to log with timestamp and level, with alignment based on message type
+        
+        Safe to call from any thread: the line is only queued here and
+        written to the widget by flush_log on the Tk main loop.
+        """
+        timestamp = time.strftime("%H:%M:%S")
+        
+        # Determine tag based on level
+        tag = self.LOG_TAGS.get(level, 'info')
+        
+        # Format message based on type
+        if level == 'SENT':
+            formatted_msg = f"[{timestamp}] {msg} ➤\n"
+        elif level == 'RECEIVED':
+            formatted_msg = f"◀ [{timestamp}] {msg}\n"
+        else:
+            formatted_msg = f"[{timestamp}] {level}: {msg}\n"
+        
+        try:
+            self.log_queue.put_nowait((formatted_msg, tag))
+        except queue.Full:
+            # The UI can't keep up; drop the line rather than block the caller
+            self.log_dropped += 1
+    
+    def flush_log(self):
+        """Write a batch of queued log lines to the widget (runs on the Tk main loop)"""
+        try:
+            chunks = []
+            while len(chunks) < LOG_BATCH_MAX * 2:
+                try:
+                    formatted_msg, tag = self.log_queue.get_nowait()
+                except queue.Empty:
+                    break
+                chunks.extend((formatted_msg, tag))
+            
+            if chunks:
+                self.log.config(state='normal')
+                # Insert all lines with their tags in a single call
+                self.log.insert(tk.END, *chunks)
+                
+                # Keep only the most recent lines
+                line_count = int(self.log.index('end-1c').split('.')[0])
+                if line_count > LOG_MAX_LINES:
+                    self.log.delete('1.0', f"{line_count - LOG_MAX_LINES + 1}.0")
+                
+                self.log.see(tk.END)
+                self.log.config(state='disabled')
+            
+            dropped = self.log_dropped
+            if dropped != self.shown_dropped:
+                self.shown_dropped = dropped
+                self.log_status.config(text=f"{dropped} log lines dropped (UI busy)")
+        finally:
+            # Come back sooner while there is a backlog
+            delay = 1 if not self.log_queue.empty() else LOG_FLUSH_INTERVAL_MS
+            self.root.after(delay, self.flush_log)
+
+    def clear_log(self):
+        """Clear the activity log"""
+        self.log.config(state='normal')
+        self.log.delete('1.0', tk.END)
+        self.log.config(state='disabled')
+        self.log_dropped = 0
+        self.shown_dropped = 0
+        self.log_status.config(text="")
+
+    def clear_message(self):
+        """Clear the message text area"""
+        self.message.delete('1.0', tk.END)
+
+    def update_connection_status(self, connected):
+        """Update UI connection status"""
+        self.is_connected = connected
+        if connected:
+            self.status_label.config(text="Connected", foreground='green')
+            self.connect_btn.config(text="Disconnect", command=self.disconnect)
+        else:
+            self.status_label.config(text="Disconnected", foreground='red')
+            self.connect_btn.config(text="Connect", command=self.connect)
+
+    def connect(self):
+        """Connect to MQTT broker with improved error handling"""
+        if self.is_connected:
+            return
+            
+        def run():
+            try:
+                username = self.username.get().strip()
+                self.server.connect(self.ip.get(), int(self.port.get()),
+                                    username, self.password.get() if username else None)
+            except Exception as e:
+                self.log_msg(f"Connection failed: {str(e)}", "ERROR")
+                self.root.after(0, lambda: self.update_connection_status(False))
+
+        # Use daemon thread for non-blocking connection
+        threading.Thread(target=run, daemon=True).start()
+
+    def disconnect(self):
+        """Disconnect from MQTT broker"""
+        self.server.disconnect()
+
+    def subscribe(self):
+        """Subscribe to a topic"""
+        if not self.is_connected:
+            self.log_msg("Not connected to broker", "WARNING")
+            return
+            
+        topics = [topic.strip() for topic in self.topic_sub.get().split(',') if topic.strip()]
+        if topics:
+            try:
+                for topic in topics:
+                    self.server.subscribe(topic)
+            except Exception as e:
+                self.log_msg(f"Subscription failed: {str(e)}", "ERROR")
+        else:
+            self.log_msg("Please enter a topic to subscribe", "WARNING")
+
+    def publish(self):
+        """Publish a message to a topic"""
+        if not self.is_connected:
+            self.log_msg("Not connected to broker", "WARNING")
+            return
+            
+        topic = self.topic_pub.get().strip()
+        msg = self.message.get("1.0", tk.END).strip()
+        
+        if not topic:
+            self.log_msg("Please enter a topic to publish", "WARNING")
+            return
+            
+        if not msg:
+            self.log_msg("Please enter a message to publish", "WARNING")
+            return
+            
+        if '{shop}' in topic:
+            # The response topic template; fill in the shop of the message
+            try:
+                shop = json_loads(msg).get('shop', '')
+            except (ValueError, AttributeError):
+                shop = ''
+            topic = shop_topic(topic, shop)
+            if topic is None:
+                self.log_msg("Topic contains {shop}: put a valid \"shop\" in the message", "WARNING")
+                return
+        
+        try:
+            self.server.publish(topic, msg)
+            self.log_msg(f"Published to [{topic}]: {msg}", "SENT")
+        except Exception as e:
+            self.log_msg(f"Publish failed: {str(e)}", "ERROR")
+
+    def shutdown(self):
+        """Stop the server core when the window is closed"""
+        self.server.shutdown()
+
+def run_gui(config=None):
+    """Run the Tk front-end over the template server core"""
+    root = tk.Tk()
+    app = MQTTApp(root, config)
+    
+    def on_closing():
+        app.shutdown()
+        root.destroy()
+    
+    root.protocol("WM_DELETE_WINDOW", on_closing)
+    root.mainloop()
@@ -0,0 +1,285 @@
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from esl_core import (
+    TEMPLATE_CACHE_MAX_BYTES, TemplateHTTPHandler, TemplateIndex, TemplateListing, TemplateManager,
+    TemplateServer, console_log, create_http_server, json_dumps, json_loads,
+    register_template_metrics, run_headless,
+)
+
+# File (in a private temporary directory) holding the template table the
+# supervisor scanned; workers load it instead of scanning the directory
+PREFORK_SNAPSHOT_NAME = 'templates.json'
+# Seconds between checks of the worker processes
+PREFORK_CHECK_INTERVAL = 1.0
+# A worker that exits sooner than this after starting is restarted with an
+# exponential backoff (starting at PREFORK_RESTART_DELAY, at most
+# PREFORK_MAX_RESTART_DELAY seconds), so a bad port does not spin
+PREFORK_MIN_UPTIME = 5.0
+PREFORK_RESTART_DELAY = 1.0
+PREFORK_MAX_RESTART_DELAY = 30.0
+# Seconds workers get to finish after SIGTERM before they are killed
+PREFORK_STOP_TIMEOUT = 10.0
+
+# Held back while a worker starts, until it has installed its own handlers
+_WORKER_SIGNALS = {signal.SIGHUP, signal.SIGINT}
+
+def write_snapshot(template_manager, path):
+    """Write the template table of template_manager to path (atomically)
+    
+    Each call writes its own temporary file, so the watcher thread and a
+    SIGHUP rescan publishing at the same time never share a half-written one.
+    """
+    directory, name = os.path.split(path)
+    f = tempfile.NamedTemporaryFile(dir=directory, prefix=name + '.', suffix='.tmp', delete=False)
+    try:
+        with f:
+            f.write(json_dumps(template_manager.snapshot()))
+        os.replace(f.name, path)
+    except BaseException:
+        os.unlink(f.name)
+        raise
+
+class SharedTemplateManager(TemplateManager):
+    """TemplateManager of a worker process, serving the supervisor's template table
+    
+    The resource directory is never scanned here; scan_templates() reloads
+    the snapshot file instead, so every worker answers with the same IDs,
+    digests and list versions as the supervisor and the other workers.
+    Template contents are still read (and cached) by each worker.
+    """
+    
+    def __init__(self, snapshot_path, resource_dir, logger=None, cache_max_bytes=TEMPLATE_CACHE_MAX_BYTES):
+        self.snapshot_path = snapshot_path
+        super().__init__(resource_dir, logger, cache_max_bytes)
+    
+    def scan_templates(self, filenames=None):
+        """Load the snapshot if the supervisor published a new version"""
+        with self._scan_lock:
+            return self._load_snapshot()
+    
+    def _load_snapshot(self):
+        changes = {'added': [], 'changed': [], 'removed': []}
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                snapshot = json_loads(f.read())
+        except (OSError, ValueError) as e:
+            if self.logger:
+                self.logger(f"Error reading template table: {str(e)}", "ERROR")
+            return changes
+        if snapshot['version'] == self.version:
+            return changes
+        
+        previous = self.templates
+        templates = snapshot['templates']
+        for filename, info in templates.items():
+            if filename not in previous:
+                changes['added'].append(filename)
+            elif previous[filename] != info:
+                changes['changed'].append(filename)
+        changes['removed'] = [filename for filename in previous if filename not in templates]
+        signatures = {filepath: tuple(signature) for filepath, signature in snapshot['signatures']}
+        
+        self.templates = templates
+        self.index = TemplateIndex(templates)
+        self.signatures = signatures
+        self.version = snapshot['version']
+        self._changed_at = snapshot['changed_at']
+        self._removed_at = OrderedDict(snapshot['removed_at'])
+        self._listing_floor = snapshot['floor']
+        self.listing = TemplateListing(self.version, templates, self._changed_at,
+                                       self._removed_at, self._listing_floor)
+        if self.cache:
+            self.cache.retain(signatures)
+        self.checksums.retain(signatures)
+        return changes
+
+def run_worker(config, slot, snapshot_path, supervisor_pid):
+    """Worker process: serve HTTP from the shared template table until SIGTERM"""
+    def log(msg, level='INFO'):
+        console_log(f"[worker {slot}] {msg}", level)
+    
+    stop = threading.Event()
+    reload = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    # Ctrl+C reaches the whole process group; the supervisor stops us
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, lambda signum, frame: reload.set())
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, _WORKER_SIGNALS)
+    
+    manager = SharedTemplateManager(snapshot_path, config['resource_dir'], log)
+    
+    def handler(*args, **kwargs):
+        return TemplateHTTPHandler(*args, template_manager=manager, **kwargs)
+    
+    try:
+        http_server = create_http_server(
+            (config['http_host'], config['http_port']), handler,
+            mode=config['http_mode'],
+            max_connections=config['http_max_connections'],
+            queue_depth=config['http_queue_depth'],
+            reuse_port=True,
+        )
+    except OSError as e:
+        log(f"Failed to start HTTP server: {str(e)}", "ERROR")
+        raise SystemExit(1)
+    http_server.health_providers = {
+        'worker': lambda: {'slot': slot, 'pid': os.getpid(), 'template_version': manager.version},
+    }
+    register_template_metrics(manager)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    log(f"Serving {len(manager.templates)} templates, version {manager.version}", "INFO")
+    
+    while not stop.is_set():
+        if reload.wait(PREFORK_CHECK_INTERVAL):
+            reload.clear()
+            manager.scan_templates()
+        if os.getppid() != supervisor_pid:
+            log("Supervisor is gone, exiting", "WARNING")
+            break
+    
+    http_server.shutdown()
+    http_server.server_close()
+
+class PreforkSupervisor:
+    """Starts the HTTP worker processes, restarts them and propagates template reloads
+    
+    Workers are started with the 'spawn' method, so they do not inherit the
+    supervisor's threads (MQTT, watcher) or its template cache.
+    """
+    
+    def __init__(self, config, processes, snapshot_path, logger=console_log):
+        self.config = config
+        self.snapshot_path = snapshot_path
+        self.logger = logger
+        self.context = multiprocessing.get_context('spawn')
+        self.workers = [None] * processes
+        self.started_at = [0.0] * processes
+        self.restart_delay = [PREFORK_RESTART_DELAY] * processes
+        self.restart_at = [0.0] * processes
+        self.restarts = 0
+    
+    def publish(self, template_manager):
+        """Write the current template table and tell the workers to load it"""
+        try:
+            write_snapshot(template_manager, self.snapshot_path)
+        except OSError as e:
+            self.logger(f"Could not write template table: {str(e)}", "ERROR")
+            return
+        for worker in self.workers:
+            if worker is not None and worker.is_alive():
+                try:
+                    os.kill(worker.pid, signal.SIGHUP)
+                except OSError:
+                    pass
+    
+    def start_worker(self, slot):
+        worker = self.context.Process(target=run_worker, name=f"esl-http-{slot}",
+                                      args=(self.config, slot, self.snapshot_path, os.getpid()))
+        # The worker unblocks these once its handlers are installed, so a
+        # reload or Ctrl+C during its start-up is not lost or fatal
+        signal.pthread_sigmask(signal.SIG_BLOCK, _WORKER_SIGNALS)
+        try:
+            worker.start()
+        finally:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, _WORKER_SIGNALS)
+        self.workers[slot] = worker
+        self.started_at[slot] = time.monotonic()
+    
+    def check(self):
+        """Restart workers that exited (with a backoff if they keep failing)"""
+        now = time.monotonic()
+        for slot, worker in enumerate(self.workers):
+            if worker is not None:
+                if worker.is_alive():
+                    continue
+                if now - self.started_at[slot] < PREFORK_MIN_UPTIME:
+                    delay = self.restart_delay[slot]
+                    self.restart_delay[slot] = min(delay * 2, PREFORK_MAX_RESTART_DELAY)
+                else:
+                    delay = self.restart_delay[slot] = PREFORK_RESTART_DELAY
+                self.logger(f"HTTP worker {slot} (pid {worker.pid}) exited with code {worker.exitcode}, "
+                            f"restarting in {delay:.0f}s", "WARNING")
+                worker.close()
+                self.workers[slot] = None
+                self.restart_at[slot] = now + delay
+                self.restarts += 1
+            if now >= self.restart_at[slot]:
+                self.start_worker(slot)
+    
+    def stop(self):
+        """Stop all workers, killing those that do not exit in time"""
+        workers = [worker for worker in self.workers if worker is not None]
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        deadline = time.monotonic() + PREFORK_STOP_TIMEOUT
+        for worker in workers:
+            worker.join(max(0.0, deadline - time.monotonic()))
+            if worker.is_alive():
+                worker.kill()
+                worker.join()
+        self.workers = [None] * len(self.workers)
+
+def run_prefork(config):
+    """Run headless with http_processes HTTP worker processes, returns an exit code
+    
+    This process scans and watches the templates and handles MQTT; the
+    workers only serve HTTP. SIGHUP forces a rescan of the resource directory.
+    """
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        console_log("SO_REUSEPORT is not available, serving HTTP from a single process", "WARNING")
+        return run_headless(dict(config, http_processes=1))
+    
+    server = TemplateServer(config)
+    processes = int(config['http_processes'])
+    directory = tempfile.mkdtemp(prefix='eslmqtt-')
+    supervisor = PreforkSupervisor(server.config, processes, os.path.join(directory, PREFORK_SNAPSHOT_NAME),
+                                   logger=server.log)
+    
+    stop = threading.Event()
+    rescan = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGHUP, lambda signum, frame: rescan.set())
+    
+    try:
+        supervisor.publish(server.template_manager)
+        if server.config['template_watch']:
+            server.start_watcher(on_change=lambda changes: supervisor.publish(server.template_manager))
+        supervisor.check()
+        server.log(f"HTTP Server started on port {server.config['http_port']} with {processes} worker "
+                   f"processes ('{server.config['http_mode']}' mode each)", "SUCCESS")
+        
+        # Keep trying until the broker is reachable; after that paho reconnects by itself
+        connected = False
+        delay = 1
+        retry_at = 0.0
+        while not stop.is_set():
+            if not connected and time.monotonic() >= retry_at:
+                try:
+                    server.connect()
+                    connected = True
+                except Exception as e:
+                    server.log(f"Connection failed: {str(e)}, retrying in {delay}s", "ERROR")
+                    retry_at = time.monotonic() + delay
+                    delay = min(delay * 2, 60)
+            if rescan.is_set():
+                rescan.clear()
+                server.template_manager.scan_templates()
+                supervisor.publish(server.template_manager)
+            supervisor.check()
+            stop.wait(PREFORK_CHECK_INTERVAL)
+    finally:
+        server.log("Shutting down", "INFO")
+        supervisor.stop()
+        server.shutdown()
+        shutil.rmtree(directory, ignore_errors=True)
+    return 0
@@ -0,0 +1,583 @@
+import base64
+import concurrent.futures
+import functools
+import hashlib
+import io
+import multiprocessing
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# Pillow does the drawing; rendering is unavailable without it
+try:
+    from PIL import Image, ImageColor, ImageDraw, ImageFont
+except ImportError:
+    Image = None
+# Optional QR code encoder; without it QR code items are left blank
+try:
+    import qrcode
+except ImportError:
+    qrcode = None
+
+from esl_core import TemplateManager, console_log, json_dumps, json_loads
+from esl_wtag import find_tag_template, load_tags, tag_template_name
+
+# Memory budget (bytes) of the cache of rendered bitmaps
+RENDER_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Processes rendering a batch (0 = one per CPU); batches with fewer unique
+# labels than RENDER_MIN_BATCH are rendered in this process
+RENDER_PROCESSES = 0
+RENDER_MIN_BATCH = 8
+# Directory (inside the resource directory) with the .ttf/.otf fonts named
+# by the templates' FontFamily; Pillow's built-in font is the fallback
+RENDER_FONT_DIR_NAME = 'fonts'
+# Text is shrunk down to this size (pixels) to fit its box
+RENDER_MIN_FONT_SIZE = 6
+
+# Characters of shop and tag IDs that may not appear in output filenames
+_UNSAFE_FILENAME_CHARS = re.compile(r'[^A-Za-z0-9_.-]')
+
+# Panel colours by the template's 'rgb' value; the first is the background
+RENDER_COLORS = {
+    'white': (255, 255, 255),
+    'black': (0, 0, 0),
+    'red': (255, 0, 0),
+    'yellow': (255, 255, 0),
+}
+RENDER_PALETTES = {
+    '2': ('white', 'black'),
+    '3': ('white', 'black', 'red'),
+    '4': ('white', 'black', 'red', 'yellow'),
+}
+
+# Code 128 bar/space widths of symbols 0-105, then the stop symbol
+CODE128_PATTERNS = (
+    '212222 222122 222221 121223 121322 131222 122213 122312 132212 221213 '
+    '221312 231212 112232 122132 122231 113222 123122 123221 223211 221132 '
+    '221231 213212 223112 312131 311222 321122 321221 312212 322112 322211 '
+    '212123 212321 232121 111323 131123 131321 112313 132113 132311 211313 '
+    '231113 231311 112133 112331 132131 113123 113321 133121 313121 211331 '
+    '231131 213113 213311 213131 311123 311321 331121 312113 312311 332111 '
+    '314111 221411 431111 111224 111422 121124 121421 141122 141221 112214 '
+    '112412 122114 122411 142112 142211 241211 221114 413111 241112 134111 '
+    '111242 121142 121241 114212 124112 124211 411212 421112 421211 212141 '
+    '214121 412121 111143 111341 131141 114113 114311 411113 411311 113141 '
+    '114131 311141 411131 211412 211214 211232 2331112'
+).split()
+CODE128_START_B = 104
+CODE128_START_C = 105
+CODE128_CODE_B = 100
+CODE128_STOP = 106
+
+def code128_widths(text):
+    """Bar and space widths (in modules, starting with a bar) of text as Code 128
+    
+    Digit strings use code set C (two digits per symbol, the last digit of an
+    odd count in code set B); anything else uses code set B.
+    """
+    if text.isdigit() and len(text) >= 2 and text.isascii():
+        pairs = len(text) // 2 * 2
+        symbols = [CODE128_START_C] + [int(text[i:i + 2]) for i in range(0, pairs, 2)]
+        if pairs < len(text):
+            symbols += [CODE128_CODE_B, ord(text[-1]) - 32]
+    else:
+        symbols = [CODE128_START_B] + [ord(c) - 32 if 32 <= ord(c) < 128 else ord('?') - 32 for c in text]
+    checksum = (symbols[0] + sum(position * symbol for position, symbol in enumerate(symbols[1:], 1))) % 103
+    symbols += [checksum, CODE128_STOP]
+    return [int(width) for symbol in symbols for width in CODE128_PATTERNS[symbol]]
+
+def parse_template(content):
+    """Layout of a template file: panel size, colours and items"""
+    data = json_loads(content)
+    size = [int(value) for value in str(data.get('Size', '0, 0')).split(',')]
+    width = int(data.get('width') or size[0])
+    height = int(data.get('height') or size[1])
+    colors = RENDER_PALETTES.get(str(data.get('rgb', '2')), RENDER_PALETTES['2'])
+    items = data.get('Items') or []
+    return {
+        'name': data.get('Name', ''),
+        'model': data.get('TagType', ''),
+        # wext/hext pad the layout to the panel's memory size
+        'width': width + int(data.get('wext') or 0),
+        'height': height + int(data.get('hext') or 0),
+        'colors': colors,
+        'items': items,
+        'keys': sorted({item['DataKey'] for item in items if item.get('DataKey')}),
+    }
+
+def values_key(template, values):
+    """Hash of the values a template actually uses, so unrelated fields share renders"""
+    used = [[key, str(values[key])] for key in template['keys'] if values.get(key) is not None]
+    return hashlib.sha1(json_dumps(used)).hexdigest()
+
+class FontSet:
+    """TrueType fonts of a directory, looked up by the templates' FontFamily"""
+    
+    def __init__(self, font_dir=None):
+        self.files = {}
+        if font_dir and os.path.isdir(font_dir):
+            for entry in sorted(os.listdir(font_dir)):
+                stem, extension = os.path.splitext(entry)
+                if extension.lower() in ('.ttf', '.otf', '.ttc'):
+                    self.files[stem] = os.path.join(font_dir, entry)
+        self._fonts = {}
+    
+    def path(self, family):
+        """Font file for family: same name, a name containing it, or the first font"""
+        if family in self.files:
+            return self.files[family]
+        for stem, path in self.files.items():
+            if family and family in stem:
+                return path
+        return next(iter(self.files.values()), None)
+    
+    def get(self, family, size):
+        font = self._fonts.get((family, size))
+        if font is None:
+            path = self.path(family)
+            if path:
+                font = ImageFont.truetype(path, size)
+            else:
+                try:
+                    font = ImageFont.load_default(size)
+                except TypeError:
+                    # Pillow < 10.1 only has the fixed-size bitmap font
+                    font = ImageFont.load_default()
+            self._fonts[(family, size)] = font
+        return font
+
+def _color(value, default=None):
+    """RGB of a template colour ('Black', '#ff0000'), None for 'Transparent'"""
+    if not value or str(value).lower() == 'transparent':
+        return default
+    try:
+        return ImageColor.getrgb(str(value))
+    except ValueError:
+        return default
+
+def _item_box(item):
+    x = int(item.get('x') or 0)
+    y = int(item.get('y') or 0)
+    return x, y, x + int(item.get('width') or 0), y + int(item.get('height') or 0)
+
+def _item_value(item, values):
+    value = values.get(item.get('DataKey')) if item.get('DataKey') else None
+    if value is None:
+        value = item.get('DataDefault')
+    return '' if value is None else str(value)
+
+def _fit_font(draw, text, family, size, width, height, fonts):
+    """Largest font up to size whose rendering of text fits the box"""
+    size = max(min(int(size or height), height), RENDER_MIN_FONT_SIZE)
+    font = fonts.get(family, size)
+    while size > RENDER_MIN_FONT_SIZE and draw.textlength(text, font=font) > width:
+        size -= 1
+        font = fonts.get(family, size)
+    return font
+
+@functools.lru_cache(maxsize=4096)
+def _text_mask(fonts, text, family, size, width, height, align, bold):
+    """Mask of text aligned in a width x height box, clipped to it
+    
+    Cached because most text items (labels, defaults) are the same on every
+    tag of a template; only the changed values need drawing.
+    """
+    mask = Image.new('L', (width, height), 0)
+    draw = ImageDraw.Draw(mask)
+    # E-paper has no grey levels, so draw without anti-aliasing
+    draw.fontmode = '1'
+    font = _fit_font(draw, text, family, size, width, height, fonts)
+    left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+    x = -left
+    if align == 1:
+        x += (width - (right - left)) // 2
+    elif align == 2:
+        x += width - (right - left)
+    y = (height - (bottom - top)) // 2 - top
+    draw.text((x, y), text, fill=255, font=font)
+    if bold:
+        # Bold: the same text again one pixel to the right
+        draw.text((x + 1, y), text, fill=255, font=font)
+    return mask
+
+def _draw_text(image, box, text, item, fonts, color):
+    """Draw text aligned in box, clipped to it"""
+    width, height = box[2] - box[0], box[3] - box[1]
+    if not text or width <= 0 or height <= 0:
+        return
+    mask = _text_mask(fonts, text, item.get('FontFamily'), item.get('FontSize'), width, height,
+                      item.get('TextAlign'), bool(int(item.get('FontStyle') or 0) & 1))
+    image.paste(color, box, mask)
+
+def _draw_barcode(image, box, text, item, fonts, color):
+    """Draw a Code 128 barcode, centered, with the text below if Showtext is set"""
+    if not text:
+        return
+    widths = code128_widths(text)
+    modules = sum(widths)
+    width, height = box[2] - box[0], box[3] - box[1]
+    scale = max(1, width // modules)
+    bar_height = int(item.get('Barheight') or height)
+    if item.get('Showtext'):
+        bar_height = min(bar_height, height - RENDER_MIN_FONT_SIZE - int(item.get('Fontinval') or 0))
+    bar_height = max(1, min(bar_height, height))
+    
+    draw = ImageDraw.Draw(image)
+    x = box[0] + max(0, (width - modules * scale) // 2)
+    for position, bar in enumerate(widths):
+        if position % 2 == 0:
+            draw.rectangle((x, box[1], x + bar * scale - 1, box[1] + bar_height - 1), fill=color)
+        x += bar * scale
+    if item.get('Showtext'):
+        text_box = (box[0], box[1] + bar_height + int(item.get('Fontinval') or 0), box[2], box[3])
+        _draw_text(image, text_box, text, dict(item, TextAlign=1), fonts, color)
+
+@functools.lru_cache(maxsize=1024)
+def _qr_matrix(text):
+    """Module matrix of a QR code; encoding dominates rendering, and labels
+    of one template usually share the same QR text (e.g. a product URL)"""
+    code = qrcode.QRCode(border=0, error_correction=qrcode.constants.ERROR_CORRECT_L)
+    code.add_data(text)
+    code.make(fit=True)
+    return code.get_matrix()
+
+def _draw_qrcode(image, box, text, color):
+    """Draw a QR code as large as fits in box, centered"""
+    if not text or qrcode is None:
+        return
+    matrix = _qr_matrix(text)
+    size = len(matrix)
+    width, height = box[2] - box[0], box[3] - box[1]
+    scale = max(1, min(width, height) // size)
+    left = box[0] + max(0, (width - size * scale) // 2)
+    top = box[1] + max(0, (height - size * scale) // 2)
+    draw = ImageDraw.Draw(image)
+    for row, cells in enumerate(matrix):
+        for column, dark in enumerate(cells):
+            if dark:
+                x, y = left + column * scale, top + row * scale
+                draw.rectangle((x, y, x + scale - 1, y + scale - 1), fill=color)
+
+def _draw_picture(image, box, data):
+    """Draw a base64 (or data: URI) image scaled to box"""
+    width, height = box[2] - box[0], box[3] - box[1]
+    if not data or width <= 0 or height <= 0:
+        return
+    if data.startswith('data:'):
+        data = data.partition(',')[2]
+    try:
+        picture = Image.open(io.BytesIO(base64.b64decode(data))).convert('RGBA')
+    except (ValueError, OSError):
+        return
+    picture = picture.resize((width, height))
+    image.paste(picture, box[:2], picture)
+
+def render_template(template, values, fonts):
+    """Render a parsed template with wtag values into a bitmap dict
+    
+    The bitmap has the panel's 'width' and 'height', the names of its ink
+    'colors' (all but the white background) and 'data': one plane per ink
+    colour, rows packed 8 pixels per byte, most significant bit first, a set
+    bit meaning the pixel has that colour.
+    """
+    image = Image.new('RGB', (template['width'], template['height']), RENDER_COLORS['white'])
+    draw = ImageDraw.Draw(image)
+    for item in template['items']:
+        box = _item_box(item)
+        if box[2] <= box[0] or box[3] <= box[1]:
+            continue
+        background = _color(item.get('Background'))
+        if background:
+            draw.rectangle((box[0], box[1], box[2] - 1, box[3] - 1), fill=background)
+        
+        kind = item.get('Type')
+        value = _item_value(item, values)
+        color = _color(item.get('FontColor'), RENDER_COLORS['black'])
+        if kind == 'text':
+            _draw_text(image, box, value, item, fonts, color)
+        elif kind == 'barcode':
+            _draw_barcode(image, box, value, item, fonts, color)
+        elif kind == 'qrcode':
+            _draw_qrcode(image, box, value, color)
+        elif kind == 'pic':
+            _draw_picture(image, box, value or item.get('dval'))
+        
+        border = _color(item.get('BorderColor'))
+        if border and item.get('BorderStyle'):
+            draw.rectangle((box[0], box[1], box[2] - 1, box[3] - 1), outline=border)
+    return pack_bitmap(image, template['colors'])
+
+def pack_bitmap(image, colors):
+    """Reduce an RGB image to the panel colours and pack one bit plane per ink colour"""
+    palette = []
+    for name in colors:
+        palette.extend(RENDER_COLORS[name])
+    # Unused palette entries repeat the background so they never win
+    palette.extend(RENDER_COLORS[colors[0]] * (256 - len(colors)))
+    palette_image = Image.new('P', (1, 1))
+    palette_image.putpalette(palette)
+    indexes = image.quantize(palette=palette_image, dither=Image.Dither.NONE).tobytes()
+    
+    planes = []
+    for index in range(1, len(colors)):
+        mask = indexes.translate(bytes(255 if value == index else 0 for value in range(256)))
+        planes.append(Image.frombytes('L', image.size, mask).convert('1', dither=Image.Dither.NONE).tobytes())
+    return {'width': image.width, 'height': image.height, 'colors': list(colors[1:]), 'data': b''.join(planes)}
+
+def bitmap_image(bitmap):
+    """RGB preview image of a rendered bitmap"""
+    size = (bitmap['width'], bitmap['height'])
+    plane_size = (bitmap['width'] + 7) // 8 * bitmap['height']
+    image = Image.new('RGB', size, RENDER_COLORS['white'])
+    for number, name in enumerate(bitmap['colors']):
+        plane = bitmap['data'][number * plane_size:(number + 1) * plane_size]
+        image.paste(RENDER_COLORS[name], (0, 0) + size, Image.frombytes('1', size, plane))
+    return image
+
+def _render_job(fonts, template, values):
+    """(bitmap, None) or (None, error message), so one bad label does not fail a batch"""
+    try:
+        return render_template(template, values, fonts), None
+    except Exception as e:
+        return None, str(e)
+
+# Fonts of a render worker process, loaded once by _init_worker
+_worker_fonts = None
+
+def _init_worker(font_dir):
+    global _worker_fonts
+    _worker_fonts = FontSet(font_dir)
+
+def _render_in_worker(template, values):
+    return _render_job(_worker_fonts, template, values)
+
+class RenderCache:
+    """LRU cache of rendered bitmaps keyed by (template md5, values hash), bounded by bytes"""
+    
+    def __init__(self, max_bytes=RENDER_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            bitmap = self._entries.get(key)
+            if bitmap is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return bitmap
+    
+    def put(self, key, bitmap):
+        size = len(bitmap['data'])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= len(old['data'])
+            while self._entries and self.current_bytes + size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted['data'])
+                self.evictions += 1
+            self._entries[key] = bitmap
+            self.current_bytes += size
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+class TagRenderer:
+    """Render wtag values onto their templates, each unique label once
+    
+    A label is identified by the template md5 and a hash of the values the
+    template uses. A batch is deduplicated and looked up in the render cache
+    first; only the remaining unique labels are rendered, on a process pool
+    when there are at least RENDER_MIN_BATCH of them.
+    """
+    
+    def __init__(self, template_manager, font_dir=None, cache_max_bytes=RENDER_CACHE_MAX_BYTES,
+                 processes=RENDER_PROCESSES, logger=None):
+        if Image is None:
+            raise RuntimeError("Tag rendering needs Pillow (pip install Pillow)")
+        self.template_manager = template_manager
+        self.font_dir = font_dir or os.path.join(template_manager.resource_dir, RENDER_FONT_DIR_NAME)
+        self.fonts = FontSet(self.font_dir)
+        self.cache = RenderCache(cache_max_bytes)
+        self.processes = processes or os.cpu_count() or 1
+        self.logger = logger
+        self.rendered = 0
+        self.failed = 0
+        # Parsed layouts by template md5
+        self._templates = {}
+        self._pool = None
+        if logger and qrcode is None:
+            logger("qrcode package not installed, QR codes are left blank", "WARNING")
+        if logger and not self.fonts.files:
+            logger(f"No fonts in {self.font_dir}, using Pillow's built-in font", "WARNING")
+    
+    def template(self, info):
+        """Parsed layout of a template (by its info dict)"""
+        template = self._templates.get(info['md5'])
+        if template is None:
+            template = parse_template(self.template_manager.read_template(info['filepath']))
+            self._templates[info['md5']] = template
+        return template
+    
+    def render(self, info, values):
+        """Bitmap of one label, from the cache if it was rendered before"""
+        return self.render_batch([(info, values)])[0]
+    
+    def render_tags(self, tags):
+        """Bitmaps of wtag tag dicts, None where the template is unknown or rendering failed
+        
+        Templates are matched by exact filename ({tmpl}_{model}.json); a tag
+        without one fails instead of being drawn with a similar template.
+        """
+        batch = []
+        unknown = set()
+        for tag in tags:
+            info = find_tag_template(self.template_manager, tag)
+            if info is None:
+                self.failed += 1
+                unknown.add(tag_template_name(tag) if tag.get('tmpl') else '(no tmpl)')
+            batch.append((info, tag.get('value') or {}))
+        if unknown and self.logger:
+            self.logger(f"No template file matches: {', '.join(sorted(unknown))}", "ERROR")
+        return self.render_batch(batch)
+    
+    def render_batch(self, batch):
+        """Bitmaps of (template info, values) pairs, rendering each unique label once"""
+        keys = []
+        bitmaps = {}
+        jobs = OrderedDict()
+        for info, values in batch:
+            if info is None:
+                keys.append(None)
+                continue
+            template = self.template(info)
+            key = (info['md5'], values_key(template, values))
+            keys.append(key)
+            if key in bitmaps or key in jobs:
+                continue
+            cached = self.cache.get(key)
+            if cached is not None:
+                bitmaps[key] = cached
+            else:
+                jobs[key] = (template, values)
+        
+        for key, (bitmap, error) in zip(jobs, self._render_jobs(list(jobs.values()))):
+            if bitmap is None:
+                self.failed += 1
+                if self.logger:
+                    self.logger(f"Rendering {jobs[key][0]['name']} failed: {error}", "ERROR")
+                continue
+            self.rendered += 1
+            bitmaps[key] = bitmap
+            self.cache.put(key, bitmap)
+        return [bitmaps.get(key) for key in keys]
+    
+    def _render_jobs(self, jobs):
+        if len(jobs) < RENDER_MIN_BATCH or self.processes <= 1:
+            return [_render_job(self.fonts, template, values) for template, values in jobs]
+        if self._pool is None:
+            # spawn: workers do not inherit the threads of a running server
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.processes, mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker, initargs=(self.font_dir,))
+        chunksize = max(1, len(jobs) // (self.processes * 4))
+        return list(self._pool.map(_render_in_worker, *zip(*jobs), chunksize=chunksize))
+    
+    def stats(self):
+        return dict(self.cache.stats(), rendered=self.rendered, failed=self.failed)
+    
+    def close(self):
+        """Stop the render processes"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+def output_stem(output_root, tag):
+    """Output path of a tag without extension, None if it would leave output_root
+    
+    Characters other than [A-Za-z0-9_.-] in the shop and tag IDs are replaced
+    by '_', so IDs from the tag file cannot name other directories.
+    """
+    name = _UNSAFE_FILENAME_CHARS.sub('_', f"{tag['shop']}_{tag['tag']}")
+    stem = os.path.join(output_root, name)
+    # Also catches symlinks in the output directory pointing elsewhere
+    for extension in ('.bin', '.png'):
+        if os.path.dirname(os.path.realpath(stem + extension)) != output_root:
+            return None
+    return stem
+
+def run_render(config, path, output_dir, shop=None, logger=console_log):
+    """Render the tags of a CSV/JSON tag file into output_dir, returns an exit code
+    
+    Every tag gets <shop>_<tag>.bin (the bit planes) and <shop>_<tag>.png (a
+    preview); identical labels are rendered once and written for each tag.
+    """
+    try:
+        tags = load_tags(path, shop)
+    except (OSError, ValueError) as e:
+        logger(f"Cannot read tag file: {str(e)}", "ERROR")
+        return 1
+    try:
+        renderer = TagRenderer(TemplateManager(config['resource_dir'], logger, read_only=True), logger=logger)
+    except RuntimeError as e:
+        logger(str(e), "ERROR")
+        return 1
+    
+    os.makedirs(output_dir, exist_ok=True)
+    output_root = os.path.realpath(output_dir)
+    start = time.perf_counter()
+    try:
+        bitmaps = renderer.render_tags(tags)
+    finally:
+        renderer.close()
+    elapsed = time.perf_counter() - start
+    
+    previews = {}
+    missing = 0
+    for tag, bitmap in zip(tags, bitmaps):
+        if bitmap is None:
+            missing += 1
+            continue
+        stem = output_stem(output_root, tag)
+        if stem is None:
+            logger(f"Tag {tag['tag']!r} of shop {tag['shop']!r} has no usable output filename", "ERROR")
+            missing += 1
+            continue
+        with open(stem + '.bin', 'wb') as f:
+            f.write(bitmap['data'])
+        # Identical labels share one bitmap object, so each PNG is encoded once
+        preview = previews.get(id(bitmap))
+        if preview is None:
+            buffer = io.BytesIO()
+            bitmap_image(bitmap).save(buffer, 'PNG')
+            preview = previews[id(bitmap)] = buffer.getvalue()
+        with open(stem + '.png', 'wb') as f:
+            f.write(preview)
+    
+    stats = renderer.stats()
+    logger(f"Rendered {len(tags) - missing} of {len(tags)} tags as {stats['rendered']} unique labels "
+           f"in {elapsed:.2f}s, output in {output_dir}", "SUCCESS")
+    if missing:
+        logger(f"{missing} tags have no known template, failed to render or have no usable output filename", "WARNING")
+    return 0 if not missing else 2
@@ -0,0 +1,365 @@
+import csv
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+
+from paho.mqtt import client as mqtt
+
+from esl_core import METRICS, TemplateManager, command_labels, console_log, json_dumps, json_loads, shop_topic
+
+# Largest wtag message (bytes) and most tags per message; a single tag larger
+# than WTAG_MAX_MESSAGE_BYTES is still sent, on its own
+WTAG_MAX_MESSAGE_BYTES = 256 * 1024
+WTAG_MAX_TAGS = 100
+# Tags per second sent to one shop (token bucket, 0 = unlimited) and how many
+# tags may be sent at once after an idle period
+WTAG_RATE = 200
+WTAG_BURST = 500
+WTAG_QOS = 1
+# Messages published but not yet acknowledged (QoS 1/2) or written (QoS 0)
+WTAG_INFLIGHT = 16
+# Seconds to wait for the acknowledgement of one message before counting it
+# as failed
+WTAG_PUBLISH_TIMEOUT = 30.0
+# Seconds to wait for the broker to accept the connection
+WTAG_CONNECT_TIMEOUT = 10.0
+WTAG_PROGRESS_INTERVAL = 1.0
+
+# Columns of a CSV row that are tag fields; all other columns go into 'value'
+WTAG_TAG_FIELDS = ('tag', 'tmpl', 'model', 'checksum', 'forcefrash', 'taskid', 'token', 'shop')
+WTAG_INT_FIELDS = ('tag', 'forcefrash', 'taskid', 'token')
+WTAG_METRIC_LABELS = command_labels('wtag')
+
+def load_tags(path, shop=None):
+    """Read tag values from a CSV or JSON file, returns a list of tag dicts
+    
+    JSON files hold a list of tag objects (as in the 'data' of a wtag message)
+    or a wtag message itself. CSV files have one tag per row: the columns in
+    WTAG_TAG_FIELDS are tag fields, every other column is a value field. A
+    tag without its own 'shop' gets the shop of the message or the shop
+    argument.
+    """
+    if path.lower().endswith('.csv'):
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            tags = [csv_tag(row) for row in csv.DictReader(f)]
+    else:
+        with open(path, 'rb') as f:
+            data = json_loads(f.read())
+        if isinstance(data, dict):
+            shop = data.get('shop') or shop
+            data = data.get('data', [])
+        if not isinstance(data, list):
+            raise ValueError(f"{path}: expected a list of tags or a wtag message")
+        tags = [dict(tag) for tag in data]
+    
+    for number, tag in enumerate(tags, 1):
+        if not tag.get('shop'):
+            if not shop:
+                raise ValueError(f"{path}: tag {number} has no shop")
+            tag['shop'] = shop
+        if tag.get('tag') in (None, ''):
+            raise ValueError(f"{path}: tag {number} has no tag ID")
+    return tags
+
+def csv_tag(row):
+    """Tag dict of one CSV row"""
+    tag = {}
+    value = {}
+    for column, cell in row.items():
+        if column is None:
+            continue
+        column = column.strip()
+        cell = (cell or '').strip()
+        if column not in WTAG_TAG_FIELDS:
+            value[column] = cell
+        elif cell:
+            tag[column] = int(cell) if column in WTAG_INT_FIELDS and cell.isdigit() else cell
+    tag['value'] = value
+    return tag
+
+def tag_template_name(tag):
+    """Template name of a tag: 'tmpl', with the model appended as in the filenames"""
+    return f"{tag['tmpl']}_{tag['model']}" if tag.get('model') else tag['tmpl']
+
+def find_tag_template(template_manager, tag):
+    """Template info of a tag by exact filename ({tmpl}_{model}.json), None if there is none
+    
+    Unlike find_template_info there is no substring fallback, which would
+    give a tag the layout of another model.
+    """
+    if not tag.get('tmpl'):
+        return None
+    name = tag_template_name(tag)
+    index = template_manager.index
+    return index.by_filename.get(f"{name}.json") or index.by_stem.get(name)
+
+def fill_tags(tags, template_manager=None):
+    """Complete tags in place: checksum from the template files, taskid and token
+    
+    Returns the tags whose checksum is missing because no template file
+    matches them exactly (their checksum is left unset).
+    """
+    taskid = int(time.time())
+    unresolved = []
+    for tag in tags:
+        if not tag.get('checksum') and template_manager:
+            info = find_tag_template(template_manager, tag)
+            if info:
+                tag['checksum'] = info['md5'].upper()
+            else:
+                unresolved.append(tag)
+        if 'taskid' not in tag:
+            taskid += 1
+            tag['taskid'] = taskid
+        if 'token' not in tag:
+            tag['token'] = random.randint(100000, 999999)
+    return unresolved
+
+def wtag_batches(tags, shop, max_bytes=WTAG_MAX_MESSAGE_BYTES, max_tags=WTAG_MAX_TAGS):
+    """Yield (payload bytes, tag count) of the wtag messages for one shop
+    
+    Every tag is encoded once; messages are assembled from the encoded tags
+    so a batch never exceeds max_bytes or max_tags.
+    """
+    head = b'{"command":"wtag","data":['
+    shop_json = json_dumps(shop)
+    # id is a 36 character UUID, timestamp at most 20 characters
+    overhead = len(head) + len(f'],"id":"{"x" * 36}","timestamp":{"9" * 20},"shop":'.encode('utf-8')) + len(shop_json) + 1
+    
+    def message(items):
+        tail = f'],"id":"{uuid.uuid4()}","timestamp":{round(time.time(), 3)},"shop":'.encode('utf-8')
+        return head + b','.join(items) + tail + shop_json + b'}'
+    
+    items = []
+    size = overhead
+    for tag in tags:
+        tag = {key: value for key, value in tag.items() if key != 'shop'}
+        item = json_dumps(tag)
+        if items and (len(items) >= max_tags or size + 1 + len(item) > max_bytes):
+            yield message(items), len(items)
+            items = []
+            size = overhead
+        items.append(item)
+        size += len(item) + 1
+    if items:
+        yield message(items), len(items)
+
+class TokenBucket:
+    """Token bucket rate limiter; rate tokens per second, at most burst saved"""
+    
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def delay(self, count):
+        """Seconds until count tokens can be taken"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        needed = min(count, self.burst)
+        return 0.0 if self.tokens >= needed else (needed - self.tokens) / self.rate
+    
+    def take(self, count):
+        """Take count tokens; a batch larger than burst leaves the bucket in debt"""
+        if self.rate > 0:
+            self._refill()
+            self.tokens -= count
+
+class WtagPublisher:
+    """Publish wtag messages in bulk with batching, rate limiting and windowing
+    
+    Messages of different shops are interleaved, each shop limited by its own
+    token bucket. At most window messages are unacknowledged at any time; the
+    oldest one is waited for before the next is published.
+    """
+    
+    def __init__(self, client, topic='esl/server/data/{shop}', qos=WTAG_QOS,
+                 max_bytes=WTAG_MAX_MESSAGE_BYTES, max_tags=WTAG_MAX_TAGS,
+                 rate=WTAG_RATE, burst=WTAG_BURST, window=WTAG_INFLIGHT,
+                 publish_timeout=WTAG_PUBLISH_TIMEOUT, logger=None):
+        self.client = client
+        self.topic = topic
+        self.qos = qos
+        self.max_bytes = max_bytes
+        self.max_tags = max_tags
+        self.rate = rate
+        self.burst = burst
+        self.window = max(1, window)
+        self.publish_timeout = publish_timeout
+        self.logger = logger
+    
+    def publish_tags(self, tags, on_progress=None, progress_interval=WTAG_PROGRESS_INTERVAL):
+        """Publish tags (dicts with a 'shop'), returns the final progress stats"""
+        by_shop = {}
+        for tag in tags:
+            by_shop.setdefault(str(tag['shop']), []).append(tag)
+        topics = {}
+        for shop in by_shop:
+            topics[shop] = shop_topic(self.topic, shop)
+            if topics[shop] is None:
+                raise ValueError(f"Shop ID {shop!r} cannot be used in a topic")
+        
+        batches = {shop: wtag_batches(shop_tags, shop, self.max_bytes, self.max_tags)
+                   for shop, shop_tags in by_shop.items()}
+        buckets = {shop: TokenBucket(self.rate, self.burst) for shop in by_shop}
+        pending = {shop: next(batches[shop], None) for shop in by_shop}
+        
+        self.stats = {
+            'tags_total': len(tags),
+            'tags_published': 0,
+            'tags_done': 0,
+            'tags_failed': 0,
+            'messages': 0,
+            'messages_failed': 0,
+            'bytes': 0,
+            'shops': len(by_shop),
+        }
+        self._started = time.monotonic()
+        inflight = deque()
+        next_progress = self._started + progress_interval
+        
+        while pending:
+            # Next message from the shop whose bucket allows it soonest
+            shop = min(pending, key=lambda shop: buckets[shop].delay(pending[shop][1]))
+            payload, count = pending[shop]
+            wait = buckets[shop].delay(count)
+            if wait > 0:
+                time.sleep(wait)
+            while len(inflight) >= self.window:
+                self._complete(inflight.popleft())
+            
+            buckets[shop].take(count)
+            info = self.client.publish(topics[shop], payload, qos=self.qos)
+            METRICS.inc('esl_mqtt_messages_published_total', WTAG_METRIC_LABELS)
+            self.stats['messages'] += 1
+            self.stats['bytes'] += len(payload)
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                self._failed(count, f"Publishing to {topics[shop]} failed: {mqtt.error_string(info.rc)}")
+            else:
+                self.stats['tags_published'] += count
+                inflight.append((info, count))
+            
+            batch = next(batches[shop], None)
+            if batch is None:
+                del pending[shop]
+            else:
+                pending[shop] = batch
+            
+            if on_progress and time.monotonic() >= next_progress:
+                on_progress(self.progress())
+                next_progress = time.monotonic() + progress_interval
+        
+        while inflight:
+            self._complete(inflight.popleft())
+        stats = self.progress()
+        if on_progress:
+            on_progress(stats)
+        return stats
+    
+    def _complete(self, entry):
+        """Wait for an in-flight message"""
+        info, count = entry
+        info.wait_for_publish(self.publish_timeout)
+        if info.is_published():
+            self.stats['tags_done'] += count
+        else:
+            self._failed(count, f"No acknowledgement for message {info.mid} within {self.publish_timeout}s")
+    
+    def _failed(self, count, msg):
+        self.stats['messages_failed'] += 1
+        self.stats['tags_failed'] += count
+        if self.logger:
+            self.logger(msg, "ERROR")
+    
+    def progress(self):
+        """Counters plus elapsed time, throughput and estimated time left"""
+        stats = dict(self.stats)
+        elapsed = time.monotonic() - self._started
+        done = stats['tags_done'] + stats['tags_failed']
+        stats['elapsed_s'] = round(elapsed, 3)
+        stats['tags_per_s'] = round(stats['tags_done'] / elapsed, 1) if elapsed > 0 else 0.0
+        stats['messages_per_s'] = round(stats['messages'] / elapsed, 1) if elapsed > 0 else 0.0
+        rate = done / elapsed if elapsed > 0 else 0
+        stats['eta_s'] = round((stats['tags_total'] - done) / rate, 1) if rate > 0 else None
+        return stats
+
+def run_bulk_publish(config, path, shop=None, qos=WTAG_QOS, rate=WTAG_RATE,
+                     max_bytes=WTAG_MAX_MESSAGE_BYTES, max_tags=WTAG_MAX_TAGS,
+                     window=WTAG_INFLIGHT, logger=console_log):
+    """Publish a CSV/JSON tag file to the broker in config, returns an exit code"""
+    try:
+        tags = load_tags(path, shop)
+    except (OSError, ValueError) as e:
+        logger(f"Cannot read tag file: {str(e)}", "ERROR")
+        return 1
+    if any(not tag.get('checksum') for tag in tags):
+        # Only looks templates up; the resource directory is left untouched
+        unresolved = fill_tags(tags, TemplateManager(config['resource_dir'], logger, cache_max_bytes=0,
+                                                     read_only=True))
+    else:
+        unresolved = fill_tags(tags)
+    if unresolved:
+        names = sorted({tag_template_name(tag) if tag.get('tmpl') else '(no tmpl)' for tag in unresolved})
+        logger(f"{len(unresolved)} tags have no checksum, no template file matches: "
+               f"{', '.join(names[:10])}{' ...' if len(names) > 10 else ''}", "WARNING")
+    
+    client = mqtt.Client(clean_session=True)
+    if config['mqtt_username']:
+        client.username_pw_set(config['mqtt_username'], config['mqtt_password'])
+    client.max_inflight_messages_set(max(window, 1))
+    connack = []
+    connected = threading.Event()
+    
+    def on_connect(client, userdata, flags, rc):
+        connack.append(rc)
+        connected.set()
+    
+    client.on_connect = on_connect
+    try:
+        client.connect(config['mqtt_host'], int(config['mqtt_port']), config['mqtt_keepalive'])
+    except OSError as e:
+        logger(f"Cannot connect to MQTT broker: {str(e)}", "ERROR")
+        return 1
+    client.loop_start()
+    if not connected.wait(WTAG_CONNECT_TIMEOUT) or connack[0] != 0:
+        reason = mqtt.connack_string(connack[0]) if connack else "no answer from the broker"
+        logger(f"MQTT broker refused the connection: {reason}", "ERROR")
+        client.disconnect()
+        client.loop_stop()
+        return 1
+    
+    def report(stats):
+        eta = '-' if stats['eta_s'] is None else f"{stats['eta_s']}s"
+        print(f"\r{stats['tags_done']}/{stats['tags_total']} tags, {stats['messages']} messages, "
+              f"{stats['tags_per_s']} tags/s, {stats['tags_failed']} failed, eta {eta}   ",
+              end='', file=sys.stderr, flush=True)
+    
+    publisher = WtagPublisher(client, topic=config['response_topic'], qos=qos,
+                              max_bytes=max_bytes, max_tags=max_tags, rate=rate,
+                              burst=max(WTAG_BURST, max_tags), window=window, logger=logger)
+    try:
+        stats = publisher.publish_tags(tags, on_progress=report)
+    except ValueError as e:
+        logger(str(e), "ERROR")
+        return 1
+    finally:
+        print(file=sys.stderr)
+        # Disconnect first so the network loop sends DISCONNECT before it stops
+        client.disconnect()
+        client.loop_stop()
+    
+    logger(f"Published {stats['tags_done']} of {stats['tags_total']} tags to {stats['shops']} shop(s) "
+           f"in {stats['messages']} messages ({stats['bytes']} bytes) in {stats['elapsed_s']}s, "
+           f"{stats['tags_per_s']} tags/s, {len(unresolved)} without checksum",
+           "SUCCESS" if not (stats['tags_failed'] or unresolved) else "WARNING")
+    return 0 if not (stats['tags_failed'] or unresolved) else 2